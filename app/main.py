@@ -1,14 +1,45 @@
 from fastapi import FastAPI
+from fastapi import Request as HTTPRequest
+from fastapi.responses import JSONResponse, Response
 import uvicorn
+import asyncio
+import atexit
+import json
 import logging
 import os
+import queue
+import random
+import time
+from logging.handlers import QueueHandler, QueueListener
 from urllib.request import Request, urlopen
 
-logging.basicConfig(level=logging.INFO)
+import workload
+from workload import Workload
+
+# Handlers only put log records on a queue; a background thread does the actual (blocking)
+# write to stderr/journald. APP_LOG_SAMPLE keeps that share of the per-request lines.
+LOG_SAMPLE = float(os.getenv("APP_LOG_SAMPLE", "1"))
+WORKERS = int(os.getenv("APP_WORKERS", "0")) or os.cpu_count() or 1
+
+log_queue: queue.SimpleQueue = queue.SimpleQueue()
+_stream = logging.StreamHandler()
+_stream.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+log_listener = QueueListener(log_queue, _stream)
+log_listener.start()
+atexit.register(log_listener.stop)
+_queued = QueueHandler(log_queue)
+_queued.setFormatter(logging.Formatter("%(message)s"))  # the listener's handler adds level and logger name
+logging.basicConfig(level=logging.INFO, handlers=[_queued])
 logger = logging.getLogger(__name__)
 app = FastAPI()
 
+def log_request(msg: str, *args):
+    if LOG_SAMPLE >= 1.0 or random.random() < LOG_SAMPLE:
+        logger.info(msg, *args)
+
 def get_instance_id() -> str:
+    if os.getenv("INSTANCE_ID"):
+        return os.environ["INSTANCE_ID"]
     try:
         req_token = Request(
             "http://169.254.169.254/latest/api/token",
@@ -27,17 +58,61 @@ def get_instance_id() -> str:
 INSTANCE_ID = get_instance_id()
 CLUSTER_NAME = os.getenv("CLUSTER_NAME")
 
+# Fault injection for local benchmarking (scripts/local_cluster.py); all off by default
+DELAY_MS = float(os.getenv("APP_DELAY_MS", "0"))
+JITTER_MS = float(os.getenv("APP_JITTER_MS", "0"))
+FAIL_RATE = float(os.getenv("APP_FAIL_RATE", "0"))
+
+async def inject_fault():
+    # sleeps for the configured latency; returns an error response for a FAIL_RATE share of requests
+    if DELAY_MS or JITTER_MS:
+        await asyncio.sleep(max(0.0, DELAY_MS + random.uniform(-JITTER_MS, JITTER_MS)) / 1000.0)
+    if FAIL_RATE and random.random() < FAIL_RATE:
+        return JSONResponse(status_code=500, content={"error": "injected failure", "instance_id": INSTANCE_ID})
+    return None
+
+def json_body(content: dict) -> bytes:
+    # the payloads are static per instance, so they are serialized once at import
+    return json.dumps(content, separators=(",", ":")).encode()
+
+ROOT_MESSAGE = "Instance has received the request"
+ROOT_BODY = json_body({"message": ROOT_MESSAGE, "instance_id": INSTANCE_ID})
+
 @app.get("/")
 async def root():
-    message = "Instance has received the request"
-    logger.info(message)
-    return {"message": message, "instance_id": INSTANCE_ID}
+    fault = await inject_fault()
+    if fault is not None:
+        return fault
+    log_request(ROOT_MESSAGE)
+    return Response(ROOT_BODY, media_type="application/json")
+
+def server_time(t0: float, phases: dict[str, float] | None = None) -> dict:
+    # total time in the app, plus one X-Server-<Phase>-Ms header per workload phase that ran
+    headers = {"X-Server-Time-Ms": f"{(time.perf_counter() - t0) * 1000.0:.3f}"}
+    for phase, ms in (phases or {}).items():
+        headers[f"X-Server-{phase.capitalize()}-Ms"] = f"{ms:.3f}"
+    return headers
 
 def register_cluster_routes(app: FastAPI, cluster: str | None):
     def factory(name: str):
-        async def handler():
-            logger.info("Serving %s on instance %s", name, INSTANCE_ID)
-            return {"cluster": name, "instance_id": INSTANCE_ID}
+        content = {"cluster": name, "instance_id": INSTANCE_ID}
+        body = json_body(content)
+
+        async def handler(request: HTTPRequest):
+            t0 = time.perf_counter()
+            fault = await inject_fault()
+            if fault is not None:
+                fault.headers.update(server_time(t0))
+                return fault
+            if request.url.query:
+                # synthetic work requested through the query string (see workload.py)
+                w = Workload.from_query(request.query_params)
+                phases = await w.run()
+                log_request("Serving %s on instance %s with %s", name, INSTANCE_ID, w)
+                return Response(json_body(w.response(content)), media_type="application/json",
+                                headers=server_time(t0, phases))
+            log_request("Serving %s on instance %s", name, INSTANCE_ID)
+            return Response(body, media_type="application/json", headers=server_time(t0))
         return handler
     if cluster in {"cluster1", "cluster2"}:
         app.get(f"/{cluster}")(factory(cluster))
@@ -47,5 +122,10 @@ def register_cluster_routes(app: FastAPI, cluster: str | None):
 
 register_cluster_routes(app, CLUSTER_NAME)
 
+@app.on_event("shutdown")
+async def _shutdown():
+    workload.shutdown()
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # one worker process per CPU (APP_WORKERS overrides); the deploy unit does the same
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, workers=WORKERS)
\ No newline at end of file
@@ -0,0 +1,133 @@
+# Synthetic per-request work for benchmarking, driven by query parameters of the cluster routes:
+#   cpu=N          N units of pure-Python CPU work (each CPU_UNIT loop iterations) in a process pool
+#   io_ms=M        await an I/O wait with mean M ms ...
+#   io_dist=D      ... drawn from fixed | uniform | exp | lognormal | pareto
+#   size=B         pad the JSON response to about B bytes
+#   mem_mb=X       fill and read back an X MiB buffer (memory-bandwidth bound), in the process pool
+# CPU and memory work are fixed amounts of work, not durations, so a slower instance type
+# (or a throttled t2 without CPU credits) takes visibly longer than a fast one.
+import asyncio
+import json
+import math
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import asdict, dataclass
+
+from fastapi import HTTPException
+
+CPU_UNIT = 10_000
+IO_DISTS = ("fixed", "uniform", "exp", "lognormal", "pareto")
+IO_SIGMA = 1.0            # lognormal shape
+PARETO_ALPHA = 2.0        # pareto shape; mean stays io_ms
+MAX_CPU = 100_000
+MAX_IO_MS = 60_000.0
+MAX_SIZE = 10 * 1024 * 1024
+# each pool process holds one mem_mb buffer at a time; keep POOL_SIZE of them well inside RAM
+# (a t2.micro has 1 GiB), or the OOM killer takes out a pool process
+MAX_MEM_MB = float(os.getenv("APP_MAX_MEM_MB", "128"))
+POOL_SIZE = int(os.getenv("APP_CPU_WORKERS", "0")) or os.cpu_count() or 1
+
+_pool: ProcessPoolExecutor | None = None
+
+def pool() -> ProcessPoolExecutor:
+    # created on first use, one per uvicorn worker
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=POOL_SIZE)
+    return _pool
+
+def shutdown():
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+
+async def in_pool(fn, arg):
+    # a pool process that died (e.g. OOM-killed) breaks the whole executor; drop it so the
+    # next request gets a fresh one, and answer this one with a 503
+    global _pool
+    p = pool()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(p, fn, arg)
+    except BrokenProcessPool:
+        if _pool is p:
+            _pool = None
+            p.shutdown(wait=False, cancel_futures=True)
+        raise HTTPException(503, "Workload process pool failed; it has been restarted")
+
+def burn(units: int) -> int:
+    acc = 0
+    for i in range(units * CPU_UNIT):
+        acc = (acc + i * i) % 1_000_003
+    return acc
+
+def touch_memory(mb: float) -> int:
+    n = int(mb * 1024 * 1024)
+    buf = bytearray(b"\x5a") * n     # write every byte
+    return buf.count(0x5a)           # read it all back, without a second buffer
+
+def io_delay(mean_ms: float, dist: str) -> float:
+    # seconds; every distribution has mean `mean_ms`
+    if dist == "uniform":
+        ms = random.uniform(0.0, 2.0 * mean_ms)
+    elif dist == "exp":
+        ms = random.expovariate(1.0 / mean_ms)
+    elif dist == "lognormal":
+        ms = random.lognormvariate(math.log(mean_ms) - IO_SIGMA ** 2 / 2, IO_SIGMA)
+    elif dist == "pareto":
+        ms = mean_ms * (PARETO_ALPHA - 1) / PARETO_ALPHA * random.paretovariate(PARETO_ALPHA)
+    else:
+        ms = mean_ms
+    return min(ms, MAX_IO_MS) / 1000.0
+
+@dataclass
+class Workload:
+    cpu: int = 0
+    io_ms: float = 0.0
+    io_dist: str = "fixed"
+    size: int = 0
+    mem_mb: float = 0.0
+
+    @classmethod
+    def from_query(cls, params) -> "Workload":
+        try:
+            w = cls(
+                cpu=int(params.get("cpu", 0)),
+                io_ms=float(params.get("io_ms", 0)),
+                io_dist=params.get("io_dist", "fixed"),
+                size=int(params.get("size", 0)),
+                mem_mb=float(params.get("mem_mb", 0)),
+            )
+        except ValueError as e:
+            raise HTTPException(422, f"Invalid workload parameter: {e}")
+        if w.io_dist not in IO_DISTS:
+            raise HTTPException(422, f"io_dist must be one of {', '.join(IO_DISTS)}")
+        if not (0 <= w.cpu <= MAX_CPU and 0 <= w.io_ms <= MAX_IO_MS
+                and 0 <= w.size <= MAX_SIZE and 0 <= w.mem_mb <= MAX_MEM_MB):
+            raise HTTPException(422, f"Workload out of range (cpu <= {MAX_CPU}, io_ms <= {MAX_IO_MS:g}, "
+                                     f"size <= {MAX_SIZE}, mem_mb <= {MAX_MEM_MB:g})")
+        return w
+
+    async def run(self) -> dict[str, float]:
+        # ms spent in each phase that ran; cpu and mem include any wait for a free pool process
+        phases = {}
+        t0 = time.perf_counter()
+        if self.io_ms > 0:
+            await asyncio.sleep(io_delay(self.io_ms, self.io_dist))
+            phases["io"], t0 = (time.perf_counter() - t0) * 1000.0, time.perf_counter()
+        if self.cpu > 0:
+            await in_pool(burn, self.cpu)
+            phases["cpu"], t0 = (time.perf_counter() - t0) * 1000.0, time.perf_counter()
+        if self.mem_mb > 0:
+            await in_pool(touch_memory, self.mem_mb)
+            phases["mem"] = (time.perf_counter() - t0) * 1000.0
+        return phases
+
+    def response(self, content: dict) -> dict:
+        out = {**content, "workload": asdict(self)}
+        if self.size > 0:
+            # compact JSON length without the pad, minus the 9 bytes of ,"pad":""
+            used = len(json.dumps(out, separators=(",", ":"))) + 9
+            out["pad"] = "x" * max(0, self.size - used)
+        return out
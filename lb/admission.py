@@ -0,0 +1,104 @@
+# Per-cluster admission control: at most `limit` proxied requests in flight to a cluster, up to
+# `queue` more waiting (for at most `queue_timeout` s) for a slot, everything beyond that is
+# rejected at once so the client can back off instead of timing out.
+# With `adaptive`, the limit is sized from upstream latency (AIMD): it grows by ~1 per `limit`
+# responses while latency stays within `tolerance` x the baseline (lowest recent latency) and
+# shrinks by `backoff` when latency exceeds that or requests fail.
+import asyncio
+import time
+from collections import deque
+
+class Overloaded(Exception):
+    def __init__(self, cluster: str, retry_after: int):
+        super().__init__(f"{cluster} is at its concurrency limit")
+        self.retry_after = retry_after
+
+class Admission:
+    def __init__(self, limit: float, queue: int, queue_timeout: float, adaptive: bool = False,
+                 max_limit: float = 1000.0, tolerance: float = 2.0, backoff: float = 0.9):
+        self.limit = float(limit)
+        self.queue = queue
+        self.queue_timeout = queue_timeout
+        self.adaptive = adaptive
+        self.min_limit = 1.0
+        self.max_limit = max_limit
+        self.tolerance = tolerance
+        self.backoff = backoff
+        self.inflight = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.baseline_ms: float | None = None
+        self.last_decrease = 0.0
+        self.admitted = 0
+        self.queued = 0
+        self.shed = 0
+
+    async def acquire(self) -> bool:
+        if self.inflight < int(self.limit) and not self.waiters:
+            self.inflight += 1
+            self.admitted += 1
+            return True
+        if len(self.waiters) >= self.queue:
+            self.shed += 1
+            return False
+        fut = asyncio.get_running_loop().create_future()
+        self.waiters.append(fut)
+        self.queued += 1
+        try:
+            await asyncio.wait((fut,), timeout=self.queue_timeout)
+        except BaseException:
+            self.drop(fut)
+            raise
+        if not fut.done():
+            self.drop(fut)
+            self.shed += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def drop(self, fut: asyncio.Future):
+        # a waiter gives up; if a slot was handed to it in the meantime, pass the slot on
+        if fut.done():
+            self.release()
+            return
+        fut.cancel()
+        try:
+            self.waiters.remove(fut)
+        except ValueError:
+            pass
+
+    def release(self):
+        self.inflight -= 1
+        self.wake()
+
+    def wake(self):
+        while self.waiters and self.inflight < int(self.limit):
+            fut = self.waiters.popleft()
+            if not fut.done():
+                self.inflight += 1
+                fut.set_result(None)
+
+    def sample(self, dt: float, ok: bool):
+        # upstream latency (ms) of one attempt; only moves the limit in adaptive mode
+        if not self.adaptive:
+            return
+        if self.baseline_ms is None or dt < self.baseline_ms:
+            self.baseline_ms = dt
+        else:
+            # drift up slowly so the baseline follows a permanently slower upstream
+            self.baseline_ms += (dt - self.baseline_ms) * 0.001
+        if not ok or dt > self.baseline_ms * self.tolerance:
+            now = time.monotonic()
+            # at most one decrease per round trip, so one burst of slow responses counts once
+            if now - self.last_decrease >= dt / 1000.0:
+                self.limit = max(self.min_limit, self.limit * self.backoff)
+                self.last_decrease = now
+        elif self.inflight >= self.limit / 2:
+            # only grow while the limit is actually in use
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self.wake()
+
+    def stats(self) -> dict:
+        return {"limit": int(self.limit), "inflight": self.inflight, "waiting": len(self.waiters),
+                "admitted": self.admitted, "queued": self.queued, "shed": self.shed,
+                "adaptive": self.adaptive,
+                "baseline_ms": None if self.baseline_ms is None else round(self.baseline_ms, 2)}
@@ -0,0 +1,94 @@
+# lb/cache.py
+# Tiny TTL + LRU response cache with request coalescing, one per cluster route.
+import asyncio, time, typing as t
+from collections import OrderedDict
+from dataclasses import dataclass
+
+@dataclass
+class Entry:
+    status: int
+    headers: list[tuple[bytes, bytes]]
+    body: bytes
+    cacheable: bool
+    expires: float = 0.0
+
+UNCACHEABLE = {"no-store", "no-cache", "private"}   # Cache-Control directives that keep a response out
+
+def cacheable(status: int, headers: list[tuple[bytes, bytes]]) -> bool:
+    # only plain shared 200s: a Set-Cookie (or anything marked private / no-cache) would
+    # otherwise be replayed to every client asking for the same key
+    if status != 200:
+        return False
+    directives = set()
+    for name, value in headers:
+        if name == b"set-cookie":
+            return False
+        if name == b"cache-control":
+            directives.update(d.split("=", 1)[0].strip() for d in value.decode("latin-1").lower().split(","))
+    return not directives & UNCACHEABLE
+
+class MicroCache:
+    def __init__(self, ttl_ms: float, max_size: int):
+        self.ttl = ttl_ms / 1000.0
+        self.max_size = max_size
+        self.entries: OrderedDict[str, Entry] = OrderedDict()
+        self.pending: dict[str, asyncio.Task] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.expired = 0
+
+    def get(self, key: str) -> Entry | None:
+        e = self.entries.get(key)
+        if e is None:
+            return None
+        if e.expires <= time.monotonic():
+            del self.entries[key]
+            self.expired += 1
+            return None
+        self.entries.move_to_end(key)
+        return e
+
+    def put(self, key: str, e: Entry):
+        e.expires = time.monotonic() + self.ttl
+        self.entries[key] = e
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_fetch(self, key: str, fetch: t.Callable[[], t.Awaitable[Entry]]) -> tuple[Entry, str]:
+        # returns (entry, "HIT" | "MISS" | "COALESCED"); concurrent misses share one fetch
+        e = self.get(key)
+        if e is not None:
+            self.hits += 1
+            return e, "HIT"
+        task = self.pending.get(key)
+        if task is not None:
+            e = await asyncio.shield(task)
+            if e.cacheable:
+                self.coalesced += 1
+                return e, "COALESCED"
+            # not meant to be shared (e.g. it sets a cookie): this client gets its own
+            self.misses += 1
+            return await fetch(), "MISS"
+        self.misses += 1
+
+        async def run() -> Entry:
+            try:
+                e = await fetch()
+                if e.cacheable:
+                    self.put(key, e)
+                return e
+            finally:
+                self.pending.pop(key, None)
+
+        # the fetch runs in its own task so a disconnecting client doesn't cancel it for the waiters
+        task = asyncio.create_task(run())
+        self.pending[key] = task
+        return await asyncio.shield(task), "MISS"
+
+    def stats(self) -> dict:
+        return {"size": len(self.entries), "hits": self.hits, "misses": self.misses,
+                "coalesced": self.coalesced, "evictions": self.evictions, "expired": self.expired}
@@ -0,0 +1,78 @@
+# Raw ASGI front for the proxy routes (LB_FAST_PATH=1). GET /<cluster> (lb.ROUTES) is served
+# here without FastAPI routing, Request objects or Response classes: pick a target, relay the
+# upstream status, headers and body as ASGI messages. Everything else (lifespan, /status,
+# /metrics, /admin/reload, other methods) is passed to the FastAPI app unchanged.
+import json
+
+import httpx
+from fastapi import HTTPException
+
+import lb
+
+JSON_HEADERS = [(b"content-type", b"application/json")]
+
+async def send_json(send, status: int, content: dict, extra: list | None = None):
+    # same bytes JSONResponse would produce
+    body = json.dumps(content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode()
+    headers = JSON_HEADERS + [(b"content-length", str(len(body)).encode())] + (extra or [])
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+async def send_body(send, status: int, headers: list, body: bytes):
+    await send({"type": "http.response.start", "status": status, "headers": headers})
+    await send({"type": "http.response.body", "body": body})
+
+def header(scope, name: bytes) -> str:
+    for k, v in scope["headers"]:
+        if k == name:
+            return v.decode("latin-1")
+    return ""
+
+class FastPath:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        cluster = lb.ROUTES.get(scope.get("path")) if scope["type"] == "http" else None
+        if cluster is None or scope["method"] != "GET" or lb.state is None:
+            return await self.app(scope, receive, send)
+        try:
+            await self.proxy(cluster, scope, send)
+        except HTTPException as e:
+            # no targets for this cluster (raised by LBState.pick)
+            await send_json(send, e.status_code, {"detail": e.detail}, [(k.encode(), v.encode()) for k, v in (e.headers or {}).items()])
+
+    async def proxy(self, cluster: str, scope, send):
+        g = lb.state.clusters.get(cluster)
+        query = scope["query_string"].decode("latin-1")
+        accept = header(scope, b"accept-encoding")
+        try:
+            if g is not None and g.cache is not None:
+                e, how = await lb.lookup(g, scope["path"], query, accept)
+                return await send_body(send, e.status, e.headers + [(b"x-cache", how.encode())], e.body)
+            up = await lb.fetch(cluster, query, accept)
+        except lb.Overloaded as e:
+            return await send_json(send, 503, {"error": "Overloaded", "detail": str(e)},
+                                   [(b"retry-after", str(e.retry_after).encode())])
+        except httpx.RequestError as e:
+            if lb.METRICS and g is not None:
+                g.metrics.gateway_errors += 1
+            return await send_json(send, 503, {"error": "Gateway Error", "detail": str(e)})
+
+        r = up.r
+        if not lb.STREAMING:
+            try:
+                body = b"".join([chunk async for chunk in r.aiter_raw()])
+            except httpx.RequestError as e:
+                return await send_json(send, 503, {"error": "Gateway Error", "detail": str(e)})
+            finally:
+                await up.close()
+            return await send_body(send, r.status_code, lb.relay_headers(r, len(body)), body)
+
+        try:
+            await send({"type": "http.response.start", "status": r.status_code, "headers": lb.relay_headers(r)})
+            async for chunk in r.aiter_raw():
+                await send({"type": "http.response.body", "body": chunk, "more_body": True})
+            await send({"type": "http.response.body", "body": b""})
+        finally:
+            await up.close()
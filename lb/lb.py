@@ -1,15 +1,79 @@
 # lb/lb.py
-import asyncio, json, os, time, typing as t
+import asyncio, json, logging, os, random, re, time
+from collections import deque
 from dataclasses import dataclass, field
-from fastapi import FastAPI, HTTPException
-from fastapi.responses import Response, JSONResponse
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import Response, JSONResponse, PlainTextResponse, StreamingResponse
 import httpx
 import math
+from admission import Admission, Overloaded
+from cache import Entry, MicroCache, cacheable
+from metrics import ClusterMetrics, TargetMetrics, header as metric_header
+from shared import SharedTable
+from strategies import STRATEGIES, RouteTable, Strategy, make_strategy
 
 CONFIG_PATH = os.getenv("LB_CONFIG", "/etc/lb/targets.json")
-PROBE_INTERVAL = float(os.getenv("LB_PROBE_INTERVAL", "2.5"))  # seconds
+PROBE_INTERVAL = float(os.getenv("LB_PROBE_INTERVAL", "2.5"))  # seconds, for a healthy target
+PROBE_FAST = float(os.getenv("LB_PROBE_FAST", "0.5"))          # unhealthy / new / volatile targets
+PROBE_SLOW = float(os.getenv("LB_PROBE_SLOW", str(4 * PROBE_INTERVAL)))  # stable or covered by live traffic
+PROBE_MAX_BACKOFF = float(os.getenv("LB_PROBE_MAX_BACKOFF", "30"))  # cap for long-dead targets
+PROBE_BACKOFF_AFTER = int(os.getenv("LB_PROBE_BACKOFF_AFTER", "5"))  # consecutive failures before backing off
+PROBE_JITTER = float(os.getenv("LB_PROBE_JITTER", "0.2"))      # +/- fraction of each delay
+PROBE_VOLATILE_MS = float(os.getenv("LB_PROBE_VOLATILE_MS", "5"))  # probe deviation below this is never volatile
+PROBE_TICK = 0.1                                                # scheduler resolution, seconds
 TIMEOUT = float(os.getenv("LB_TIMEOUT", "1.5"))                 # per-probe timeout
 ALPHA = float(os.getenv("LB_EWMA_ALPHA", "0.3"))                # EWMA smoothing
+LIVE_ALPHA = float(os.getenv("LB_LIVE_EWMA_ALPHA", "0.1"))      # EWMA smoothing for live-traffic samples
+LIVE_WINDOW = float(os.getenv("LB_LIVE_WINDOW", str(2 * PROBE_INTERVAL)))  # live samples newer than this win over probes
+POOL_SIZE = int(os.getenv("LB_POOL_SIZE", "200"))               # max upstream connections (all hosts)
+KEEPALIVE_EXPIRY = float(os.getenv("LB_KEEPALIVE_EXPIRY", "30"))  # idle keep-alive seconds
+MAX_PER_HOST = int(os.getenv("LB_MAX_PER_HOST", "50"))          # per-target connection cap (0 = unlimited)
+STREAMING = os.getenv("LB_STREAMING", "1") == "1"               # stream bodies instead of buffering
+FAST_PATH = os.getenv("LB_FAST_PATH", "0") == "1"              # serve proxy routes from fastpath.py, not FastAPI
+STRATEGY = os.getenv("LB_STRATEGY", "fastest")                  # default; targets.json and LB_STRATEGY_<CLUSTER> override
+PEAK_DECAY = float(os.getenv("LB_PEAK_DECAY", "10.0"))          # seconds for peak EWMA to decay back down
+RETRIES = int(os.getenv("LB_RETRIES", "2"))                     # extra attempts on connect errors
+RETRY_BUDGET = float(os.getenv("LB_RETRY_BUDGET", "0.2"))       # retries + hedges as a fraction of requests
+RETRY_BURST = float(os.getenv("LB_RETRY_BURST", "10"))          # retries banked for quiet periods
+HEDGE_PERCENTILE = float(os.getenv("LB_HEDGE_PERCENTILE", "0")) # hedge after this latency pct (0 = off); per cluster via LB_HEDGE_PERCENTILE_<CLUSTER>
+HEDGE_WINDOW = int(os.getenv("LB_HEDGE_WINDOW", "1000"))        # recent samples the percentile is taken over
+HEDGE_MIN_SAMPLES = 50
+SHM_PATH = os.getenv("LB_SHM_PATH", "")                         # set for uvicorn --workers N: one prober, shared table
+SHM_POLL = float(os.getenv("LB_SHM_POLL", "0.5"))               # seconds between non-leader table reads
+CACHE_TTL_MS = float(os.getenv("LB_CACHE_TTL_MS", "0"))         # GET micro-cache TTL (0 = off); LB_CACHE_TTL_MS_<CLUSTER> per route
+CACHE_SIZE = int(os.getenv("LB_CACHE_SIZE", "1024"))            # max cached responses per route (LRU)
+METRICS = os.getenv("LB_METRICS", "1") == "1"                   # record /metrics counters and histograms
+RELOAD_INTERVAL = float(os.getenv("LB_RELOAD_INTERVAL", "2"))   # seconds between LB_CONFIG mtime checks (0 = off)
+DRAIN_TIMEOUT = float(os.getenv("LB_DRAIN_TIMEOUT", "30"))      # max seconds a removed target may finish in-flight work
+HEALTHY_THRESHOLD = int(os.getenv("LB_HEALTHY_THRESHOLD", "2"))  # consecutive good probes before a failed target is back
+EJECT_CONSECUTIVE = int(os.getenv("LB_EJECT_CONSECUTIVE", "5"))  # consecutive live errors that eject a target (0 = off)
+EJECT_ERROR_RATE = float(os.getenv("LB_EJECT_ERROR_RATE", "0.5"))  # live error ratio over LB_EJECT_INTERVAL that ejects
+EJECT_MIN_REQUESTS = int(os.getenv("LB_EJECT_MIN_REQUESTS", "20"))  # requests needed in the interval to judge the ratio
+EJECT_INTERVAL = float(os.getenv("LB_EJECT_INTERVAL", "10"))    # seconds per error-rate window
+EJECT_TIME = float(os.getenv("LB_EJECT_TIME", "30"))            # base ejection; multiplied by the target's ejection count
+EJECT_MAX_TIME = float(os.getenv("LB_EJECT_MAX_TIME", "300"))
+EJECT_MAX_PERCENT = float(os.getenv("LB_EJECT_MAX_PERCENT", "50"))  # never eject more of a cluster than this
+CB_FAILURES = int(os.getenv("LB_CB_FAILURES", "3"))             # consecutive live errors that open the breaker (0 = off)
+CB_OPEN_TIME = float(os.getenv("LB_CB_OPEN_TIME", "5"))         # seconds open before half-open trial requests
+CB_HALF_OPEN_MAX = int(os.getenv("LB_CB_HALF_OPEN_MAX", "1"))   # concurrent trial requests while half-open
+SLOW_START = float(os.getenv("LB_SLOW_START", "20"))            # seconds over which a recovered target ramps to full share
+SLOW_START_MIN = 0.05                                           # share a recovered target starts at
+ADMIT_LIMIT = int(os.getenv("LB_ADMIT_LIMIT", "0"))             # max in-flight requests per cluster (0 = no limit)
+ADMIT_QUEUE = int(os.getenv("LB_ADMIT_QUEUE", "100"))           # requests that may wait for a slot; the rest get 503
+ADMIT_QUEUE_TIMEOUT = float(os.getenv("LB_ADMIT_QUEUE_TIMEOUT", "0.5"))  # max seconds waiting for a slot
+ADMIT_ADAPTIVE = os.getenv("LB_ADMIT_ADAPTIVE", "0") == "1"     # size the limit from upstream latency (AIMD)
+ADMIT_MAX = float(os.getenv("LB_ADMIT_MAX", "1000"))            # upper bound for the adaptive limit
+ADMIT_TOLERANCE = float(os.getenv("LB_ADMIT_TOLERANCE", "2"))   # latency over this x baseline shrinks the limit
+RETRY_AFTER = int(os.getenv("LB_RETRY_AFTER", "1"))             # Retry-After seconds on shed requests
+
+logger = logging.getLogger("lb")
+
+HOP_BY_HOP = {
+    b"connection", b"keep-alive", b"proxy-authenticate", b"proxy-authorization",
+    b"te", b"trailer", b"trailers", b"transfer-encoding", b"upgrade",
+}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"   # circuit breaker states
 
 @dataclass
 class Target:
@@ -19,22 +83,283 @@ class Target:
     last_ms: float = 9999.0
     last_ok: float = 0.0
     failures: int = 0
+    probe_ewma_ms: float = 5000.0     # probe-only view of ewma_ms, for /status
+    live_ewma_ms: float = 0.0         # traffic-only view of ewma_ms, for /status
+    live_last_ms: float = 0.0
+    live_samples: int = 0
+    live_errors: int = 0
+    last_live: float = 0.0            # time.monotonic() of the last live sample
+    peak_ms: float = 5000.0           # peak-sensitive EWMA: jumps up on spikes, decays over PEAK_DECAY
+    peak_t: float = 0.0
+    inflight: int = 0                 # proxied requests currently outstanding
+    draining: float = 0.0             # time.monotonic() it was removed from the config; 0 = active
+    dev_ms: float = 0.0               # EWMA of |probe sample - probe_ewma_ms|: latency volatility
+    probe_samples: int = 0            # successful probes ever; the first one seeds probe_ewma_ms
+    successes: int = 0                # consecutive successful probes
+    next_probe: float = 0.0           # time.monotonic() the next probe is due
+    probing: bool = False             # a probe is in flight
+    live_consecutive: int = 0         # consecutive live-traffic errors
+    win_start: float = 0.0            # error-rate window for outlier ejection
+    win_requests: int = 0
+    win_errors: int = 0
+    ejected_until: float = 0.0        # time.monotonic(); 0 = not ejected
+    ejections: int = 0                # recent ejections, scales the next ejection time
+    last_ejected: float = 0.0
+    breaker: str = CLOSED
+    breaker_until: float = 0.0
+    slow_start_at: float = 0.0        # time.monotonic() it came back; 0 = full share
+    sem: asyncio.Semaphore | None = field(default=None, repr=False)  # per-host connection cap
+    metrics: TargetMetrics | None = field(default=None, repr=False)
+
+def route_table(targets: list[Target]) -> RouteTable:
+    # what the strategies choose from: healthy targets not ejected or cut off by their breaker,
+    # falling back to any healthy one, then to any active one; fastest first
+    active = [t for t in targets if not t.draining]
+    healthy = [t for t in active if t.healthy]
+    usable = [t for t in healthy if not t.ejected_until and t.breaker != OPEN]
+    return RouteTable.from_ranked(tuple(sorted(usable or healthy or active, key=lambda t: (t.ewma_ms, t.last_ms))))
+
+class RetryBudget:
+    # token bucket: each request deposits `ratio` tokens, each retry or hedge spends one, so
+    # extra load stays a bounded fraction of traffic even when every request is failing
+    def __init__(self, ratio: float = RETRY_BUDGET, burst: float = RETRY_BURST):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = burst
+        self.spent = 0
+        self.denied = 0
+
+    def deposit(self):
+        self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        if self.tokens >= 1.0:
+            self.tokens -= 1.0
+            self.spent += 1
+            return True
+        self.denied += 1
+        return False
 
 @dataclass
 class ClusterState:
     name: str
     targets: list[Target] = field(default_factory=list)
+    strategy: Strategy = field(default_factory=lambda: make_strategy(STRATEGY))
+    table: RouteTable = field(default_factory=RouteTable)
+    budget: RetryBudget = field(default_factory=RetryBudget)
+    hedge_pct: float = 0.0
+    hedge_after_ms: float | None = None   # recomputed on each table rebuild from latencies
+    latencies: deque = field(default_factory=lambda: deque(maxlen=HEDGE_WINDOW))
+    retries: int = 0
+    hedges: int = 0
+    hedge_wins: int = 0
+    ejections: int = 0
+    breaker_trips: int = 0
+    cache: MicroCache | None = None
+    admission: Admission | None = None
+    metrics: ClusterMetrics | None = field(default=None, repr=False)
+
+def update_peak(tgt: Target, dt: float):
+    now = time.monotonic()
+    if dt > tgt.peak_ms:
+        tgt.peak_ms = dt
+    else:
+        w = math.exp(-(now - tgt.peak_t) / PEAK_DECAY)
+        tgt.peak_ms = tgt.peak_ms * w + dt * (1.0 - w)
+    tgt.peak_t = now
+
+def probe_delay(tgt: Target) -> float:
+    # seconds until the next probe of tgt, given what the last one (and live traffic) showed
+    if not tgt.healthy:
+        if tgt.failures < PROBE_BACKOFF_AFTER:
+            delay = PROBE_FAST  # new or just failed: find out quickly
+        else:
+            delay = min(PROBE_MAX_BACKOFF, PROBE_FAST * 2 ** (tgt.failures - PROBE_BACKOFF_AFTER + 1))
+    elif tgt.dev_ms > max(0.5 * tgt.probe_ewma_ms, PROBE_VOLATILE_MS):
+        # volatile latency; the floor keeps sub-millisecond jitter on a ~1 ms LAN from counting
+        delay = min(PROBE_INTERVAL, 2 * PROBE_FAST)
+    elif time.monotonic() - tgt.last_live < LIVE_WINDOW or tgt.successes >= 5:
+        delay = PROBE_SLOW  # live samples already cover it, or it has been stable for a while
+    else:
+        delay = PROBE_INTERVAL
+    return delay * random.uniform(1.0 - PROBE_JITTER, 1.0 + PROBE_JITTER)
+
+def is_outlier(tgt: Target) -> bool:
+    if EJECT_CONSECUTIVE > 0 and tgt.live_consecutive >= EJECT_CONSECUTIVE:
+        return True
+    return tgt.win_requests >= EJECT_MIN_REQUESTS and tgt.win_errors / tgt.win_requests >= EJECT_ERROR_RATE
+
+def breaker_admits(tgt: Target) -> bool:
+    if tgt.breaker == CLOSED:
+        return True
+    return tgt.breaker == HALF_OPEN and tgt.inflight < CB_HALF_OPEN_MAX
+
+def ramp(tgt: Target) -> float:
+    # share of its normal traffic a target in slow start may take, SLOW_START_MIN..1
+    if not tgt.slow_start_at:
+        return 1.0
+    return max(SLOW_START_MIN, min(1.0, (time.monotonic() - tgt.slow_start_at) / SLOW_START))
+
+def target_state(tgt: Target) -> str:
+    if tgt.draining:
+        return "draining"
+    if tgt.ejected_until:
+        return "ejected"
+    if tgt.breaker != CLOSED:
+        return f"breaker_{tgt.breaker}"
+    if tgt.healthy:
+        return "slow_start" if tgt.slow_start_at else "healthy"
+    return "probing" if tgt.last_ok == 0 else "unhealthy"
+
+def cluster_env(var: str, cluster: str, default: str) -> str:
+    # LB_FOO_CLUSTER2 overrides LB_FOO for one cluster
+    return os.getenv(f"{var}_{cluster.upper()}", default)
+
+def strategy_for(cluster: str, configured: str | None = None) -> str:
+    # LB_STRATEGY_<CLUSTER>, then the cluster's "strategy" in targets.json, then LB_STRATEGY
+    name = cluster_env("LB_STRATEGY", cluster, configured or STRATEGY)
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown LB strategy {name!r} for {cluster}; choose from {sorted(STRATEGIES)}")
+    return name
+
+@dataclass
+class ClusterConfig:
+    targets: list[str]
+    strategy: str    # resolved through strategy_for
+
+CLUSTER_NAME = re.compile(r"[A-Za-z0-9_-]+")
+RESERVED = {"status", "metrics", "admin", "docs", "redoc", "openapi.json"}   # paths the LB serves itself
+
+def parse_config(cfg: dict) -> dict[str, ClusterConfig]:
+    # targets.json: {"cluster1": ["http://...", ...]} or {"cluster1": {"strategy": "p2c", "targets": [...]}};
+    # raises ValueError on anything it can't use, before any of it is applied
+    out = {}
+    for name, spec in cfg.items():
+        if not CLUSTER_NAME.fullmatch(name) or name in RESERVED:
+            raise ValueError(f"Invalid cluster name {name!r}")
+        if isinstance(spec, dict):
+            urls, configured = spec.get("targets", []), spec.get("strategy")
+        else:
+            urls, configured = spec, None
+        if not isinstance(urls, list):
+            raise ValueError(f"Targets of {name} must be a list of URLs")
+        # sanity: only keep http urls
+        out[name] = ClusterConfig([u for u in urls if isinstance(u, str) and u.startswith("http://")],
+                                  strategy_for(name, configured))
+    return out
 
 class LBState:
-    def __init__(self, cfg: dict[str, list[str]]):
+    def __init__(self, cfg: dict):
         self.clusters: dict[str, ClusterState] = {}
-        for name, urls in cfg.items():
-            self.clusters[name] = ClusterState(
-                name=name,
-                targets=[Target(url=u) for u in urls]
-            )
-        self._lock = asyncio.Lock()
         self._stop = False
+        self.shared: SharedTable | None = None
+        self.client: httpx.AsyncClient | None = None
+        self.config_stamp: tuple[int, int] | None = None
+        self._probes: set[asyncio.Task] = set()
+        self._dirty = False  # a probe finished since the routing tables were last rebuilt
+        self.reload_gen = 0  # shared reload generation this worker has applied (multi-worker mode)
+        self._rebuilt = 0.0
+        self.apply_config(cfg)
+
+    def new_cluster(self, name: str, strategy: str) -> ClusterState:
+        g = ClusterState(
+            name=name,
+            strategy=make_strategy(strategy),
+            hedge_pct=float(cluster_env("LB_HEDGE_PERCENTILE", name, str(HEDGE_PERCENTILE))),
+        )
+        g.metrics = ClusterMetrics(name)
+        ttl_ms = float(cluster_env("LB_CACHE_TTL_MS", name, str(CACHE_TTL_MS)))
+        if ttl_ms > 0:
+            g.cache = MicroCache(ttl_ms, CACHE_SIZE)
+        limit = int(cluster_env("LB_ADMIT_LIMIT", name, str(ADMIT_LIMIT)))
+        adaptive = cluster_env("LB_ADMIT_ADAPTIVE", name, str(int(ADMIT_ADAPTIVE))) == "1"
+        if limit > 0 or adaptive:
+            g.admission = Admission(
+                limit if limit > 0 else 32,
+                int(cluster_env("LB_ADMIT_QUEUE", name, str(ADMIT_QUEUE))),
+                ADMIT_QUEUE_TIMEOUT,
+                adaptive=adaptive,
+                max_limit=ADMIT_MAX,
+                tolerance=ADMIT_TOLERANCE,
+            )
+        return g
+
+    def new_target(self, cluster: str, url: str) -> Target:
+        # starts unhealthy ("probing") until its first successful probe
+        tgt = Target(url=url)
+        tgt.metrics = TargetMetrics(cluster, url)
+        if MAX_PER_HOST > 0:
+            tgt.sem = asyncio.Semaphore(MAX_PER_HOST)
+        return tgt
+
+    def apply_config(self, cfg: dict) -> dict:
+        # diff cfg against the live clusters: known targets keep their state, new ones are
+        # added, removed ones drain (no new requests) until their in-flight requests finish
+        specs = parse_config(cfg)
+        now = time.monotonic()
+        added, removed = [], []
+        for name in list(dict.fromkeys([*self.clusters, *specs])):
+            spec = specs.get(name)
+            g = self.clusters.get(name)
+            if g is None:
+                g = self.new_cluster(name, spec.strategy)
+            elif spec is not None and spec.strategy != g.strategy.name:
+                g.strategy = make_strategy(spec.strategy)
+                logger.info("Strategy of %s is now %s", name, spec.strategy)
+            if spec is not None:
+                route_cluster(name)
+            current = {t.url: t for t in g.targets}
+            targets = []
+            for url in dict.fromkeys(spec.targets if spec is not None else []):
+                tgt = current.pop(url, None)
+                if tgt is None:
+                    tgt = self.new_target(name, url)
+                    added.append(url)
+                tgt.draining = 0.0
+                targets.append(tgt)
+            for tgt in current.values():
+                if not tgt.draining:
+                    tgt.draining = now
+                    removed.append(tgt.url)
+                targets.append(tgt)
+            g.targets = targets
+            self.clusters[name] = g
+        self.reap()
+        self.rebuild()
+        return {"added": added, "removed": removed}
+
+    def reap(self):
+        # forget drained targets, and clusters left without any
+        now = time.monotonic()
+        for name, g in list(self.clusters.items()):
+            if any(t.draining for t in g.targets):
+                kept = [t for t in g.targets
+                        if not t.draining or (t.inflight > 0 and now - t.draining < DRAIN_TIMEOUT)]
+                if len(kept) != len(g.targets):
+                    g.targets = kept
+                    self._dirty = True
+            if not g.targets:
+                del self.clusters[name]
+
+    def reload(self, path: str = CONFIG_PATH) -> dict:
+        st = os.stat(path)
+        diff = self.apply_config(load_config(path))
+        self.config_stamp = (st.st_mtime_ns, st.st_size)
+        if diff["added"] or diff["removed"]:
+            logger.info("Reloaded %s: +%d -%d targets", path, len(diff["added"]), len(diff["removed"]))
+        return diff
+
+    async def run_config_watcher(self, path: str = CONFIG_PATH):
+        while not self._stop:
+            await asyncio.sleep(RELOAD_INTERVAL)
+            try:
+                st = os.stat(path)
+                if (st.st_mtime_ns, st.st_size) != self.config_stamp:
+                    # newcomers have next_probe == 0, so the prober picks them up on its next tick
+                    self.reload(path)
+            except (OSError, ValueError) as e:
+                # e.g. the file is mid-write; keep the current config and try again next tick
+                logger.warning("Config reload of %s failed: %s", path, e)
 
     async def probe_once(self, client: httpx.AsyncClient, tgt: Target):
         t0 = time.perf_counter()
@@ -42,105 +367,678 @@ class LBState:
             r = await client.get(tgt.url, timeout=TIMEOUT)
             ok = (200 <= r.status_code < 500)  # treat 4xx as up for lb selection
             dt = (time.perf_counter() - t0) * 1000.0
+            if METRICS:
+                tgt.metrics.probe.observe(dt)
             if ok:
+                recovering = not tgt.healthy and tgt.last_ok != 0
                 tgt.last_ms = dt
-                tgt.ewma_ms = ALPHA * dt + (1.0 - ALPHA) * tgt.ewma_ms
-                tgt.healthy = True
+                if tgt.probe_samples == 0:
+                    # seeded like live_ewma_ms; deviation from the 5000 ms prior would make every
+                    # new target look volatile (and be probed at LB_PROBE_FAST) for dozens of probes
+                    tgt.probe_ewma_ms = dt
+                else:
+                    tgt.dev_ms = ALPHA * abs(dt - tgt.probe_ewma_ms) + (1.0 - ALPHA) * tgt.dev_ms
+                    tgt.probe_ewma_ms = ALPHA * dt + (1.0 - ALPHA) * tgt.probe_ewma_ms
+                tgt.probe_samples += 1
+                # live traffic is the better signal; probes only steer idle targets
+                if time.monotonic() - tgt.last_live > LIVE_WINDOW:
+                    tgt.ewma_ms = ALPHA * dt + (1.0 - ALPHA) * tgt.ewma_ms
                 tgt.last_ok = time.time()
+                update_peak(tgt, dt)
                 tgt.failures = 0
+                tgt.successes += 1
+                # one good probe is not enough to trust a target that was failing
+                if not tgt.healthy and (not recovering or tgt.successes >= HEALTHY_THRESHOLD):
+                    tgt.healthy = True
+                    if recovering:
+                        tgt.slow_start_at = time.monotonic()
             else:
+                tgt.successes = 0
                 tgt.failures += 1
                 tgt.healthy = False
                 tgt.ewma_ms = min(9999.0, tgt.ewma_ms * 1.5)
         except Exception:
+            if METRICS:
+                tgt.metrics.probe.observe((time.perf_counter() - t0) * 1000.0)
+            tgt.successes = 0
             tgt.failures += 1
             tgt.healthy = False
             tgt.ewma_ms = min(9999.0, tgt.ewma_ms * 1.5)
 
+    def observe(self, g: ClusterState, tgt: Target, dt: float, ok: bool):
+        # passive sample from a proxied request (dt = time to upstream response headers, ms)
+        tgt.live_last_ms = dt
+        tgt.win_requests += 1
+        if ok:
+            tgt.live_consecutive = 0
+            if tgt.breaker == HALF_OPEN:
+                tgt.breaker = CLOSED
+                tgt.slow_start_at = time.monotonic()
+                self._dirty = True
+            if tgt.live_samples == 0:
+                tgt.live_ewma_ms = dt
+            else:
+                tgt.live_ewma_ms = LIVE_ALPHA * dt + (1.0 - LIVE_ALPHA) * tgt.live_ewma_ms
+            tgt.live_samples += 1
+            update_peak(tgt, dt)
+            tgt.last_live = time.monotonic()
+            tgt.ewma_ms = LIVE_ALPHA * dt + (1.0 - LIVE_ALPHA) * tgt.ewma_ms
+        else:
+            tgt.live_errors += 1
+            tgt.win_errors += 1
+            tgt.live_consecutive += 1
+            tgt.ewma_ms = min(9999.0, tgt.ewma_ms * 1.5)
+            # circuit breaker: trips straight from the request path, no waiting for the prober
+            if tgt.breaker == HALF_OPEN or (
+                tgt.breaker == CLOSED and CB_FAILURES > 0 and tgt.live_consecutive >= CB_FAILURES
+            ):
+                tgt.breaker = OPEN
+                tgt.breaker_until = time.monotonic() + CB_OPEN_TIME
+                g.breaker_trips += 1
+                self._dirty = True
+
+    def check_targets(self):
+        # periodic upkeep: drained targets, breaker half-open transitions, outlier ejection
+        # and its expiry, end of slow start
+        self.reap()
+        now = time.monotonic()
+        for g in self.clusters.values():
+            active = [t for t in g.targets if not t.draining]
+            max_ejected = int(len(active) * EJECT_MAX_PERCENT / 100.0)
+            ejected = sum(1 for t in active if t.ejected_until)
+            for tgt in active:
+                if tgt.breaker == OPEN and now >= tgt.breaker_until:
+                    tgt.breaker = HALF_OPEN
+                    self._dirty = True
+                if tgt.ejected_until and now >= tgt.ejected_until:
+                    tgt.ejected_until = 0.0
+                    tgt.slow_start_at = now
+                    ejected -= 1
+                    self._dirty = True
+                elif not tgt.ejected_until and ejected < max_ejected and is_outlier(tgt):
+                    tgt.ejections += 1
+                    tgt.ejected_until = now + min(EJECT_MAX_TIME, EJECT_TIME * tgt.ejections)
+                    tgt.last_ejected = now
+                    tgt.live_consecutive = tgt.win_requests = tgt.win_errors = 0
+                    g.ejections += 1
+                    ejected += 1
+                    self._dirty = True
+                    logger.warning("Ejected %s for %.0fs", tgt.url, tgt.ejected_until - now)
+                if tgt.ejections and not tgt.ejected_until and now - tgt.last_ejected > EJECT_MAX_TIME:
+                    tgt.ejections = 0
+                if now - tgt.win_start >= EJECT_INTERVAL:
+                    tgt.win_start = now
+                    tgt.win_requests = tgt.win_errors = 0
+                if tgt.slow_start_at and now - tgt.slow_start_at >= SLOW_START:
+                    tgt.slow_start_at = 0.0
+
     async def run_prober(self):
-        async with httpx.AsyncClient() as client:
-            while not self._stop:
-                async with self._lock:
-                    groups = list(self.clusters.values())
-                tasks = []
-                for g in groups:
-                    for tgt in g.targets:
-                        tasks.append(self.probe_once(client, tgt))
-                if tasks:
-                    await asyncio.gather(*tasks, return_exceptions=True)
-                await asyncio.sleep(PROBE_INTERVAL)
-
-    async def pick_fastest(self, cluster: str) -> Target:
-        async with self._lock:
-            g = self.clusters.get(cluster)
-            if not g or not g.targets:
-                raise HTTPException(503, f"No targets configured for {cluster}")
-            healthy = [t for t in g.targets if t.healthy]
-            candidates = healthy if healthy else g.targets
-            # choose min ewma; tie-breaker last_ms
-            best = min(candidates, key=lambda t: (t.ewma_ms, t.last_ms))
-            return best
-
-    async def snapshot(self):
-        async with self._lock:
-            out = {}
-            for name, g in self.clusters.items():
-                out[name] = [
-                    {"url": t.url, "healthy": t.healthy, "ewma_ms": round(t.ewma_ms, 1),
-                     "last_ms": round(t.last_ms, 1), "failures": t.failures,
-                     "last_ok_s_ago": None if t.last_ok == 0 else round(time.time()-t.last_ok,1)}
-                    for t in g.targets
-                ]
-            return out
-
-def load_config(path: str) -> dict[str, list[str]]:
+        # probes share the request pool (keep-alive conns are warm for both) but
+        # skip the per-host semaphore so a saturated target can still be probed
+        while not self._stop:
+            self.launch_due_probes()
+            self.refresh()
+            await asyncio.sleep(PROBE_TICK)
+
+    def refresh(self) -> bool:
+        # rebuild routing tables when a probe finished, and at least every PROBE_INTERVAL
+        # so that rankings follow live-traffic latency between (now sparser) probes
+        self.check_targets()
+        if self._dirty or time.monotonic() - self._rebuilt >= PROBE_INTERVAL:
+            self._dirty = False
+            self.rebuild()
+            return True
+        return False
+
+    def launch_due_probes(self):
+        # each target runs on its own jittered schedule instead of in lockstep rounds
+        now = time.monotonic()
+        for g in list(self.clusters.values()):
+            for tgt in g.targets:
+                if not tgt.draining and not tgt.probing and tgt.next_probe <= now:
+                    tgt.probing = True
+                    task = asyncio.create_task(self.probe_scheduled(tgt))
+                    self._probes.add(task)
+                    task.add_done_callback(self._probes.discard)
+
+    async def probe_scheduled(self, tgt: Target):
+        assert self.client is not None
+        try:
+            await self.probe_once(self.client, tgt)
+        finally:
+            tgt.probing = False
+            tgt.next_probe = time.monotonic() + probe_delay(tgt)
+            self._dirty = True
+
+    async def run_shared(self):
+        # multi-worker mode: the worker holding the shared table's lock probes and
+        # publishes; every other worker just follows the table
+        assert self.shared is not None
+        while not self._stop:
+            self.follow_reloads()
+            if self.shared.try_lead():
+                self.launch_due_probes()
+                if self.refresh():
+                    self.shared.publish(self.rows())
+                await asyncio.sleep(PROBE_TICK)
+            else:
+                rows = self.shared.read()
+                if rows:
+                    self.apply(rows)
+                    self._dirty = True
+                self.refresh()
+                await asyncio.sleep(SHM_POLL)
+
+    def follow_reloads(self):
+        # another worker served POST /admin/reload: apply the same file here
+        assert self.shared is not None
+        gen = self.shared.reload_generation()
+        if gen != self.reload_gen:
+            self.reload_gen = gen
+            try:
+                self.reload(CONFIG_PATH)
+            except (OSError, ValueError) as e:
+                logger.warning("Config reload of %s failed: %s", CONFIG_PATH, e)
+
+    def rows(self) -> list:
+        return [
+            (t.url, t.healthy, t.ewma_ms, t.last_ms, t.probe_ewma_ms, t.peak_ms, t.last_ok, t.failures)
+            for g in self.clusters.values() for t in g.targets
+        ]
+
+    def apply(self, rows: dict):
+        now = time.monotonic()
+        for g in self.clusters.values():
+            for tgt in g.targets:
+                row = rows.get(tgt.url)
+                if row is None:
+                    continue
+                # a target that was failing and is healthy again ramps up here too (the leader's
+                # probe_once does this for its own worker only)
+                recovering = not tgt.healthy and tgt.last_ok != 0
+                _, tgt.healthy, ewma_ms, tgt.last_ms, tgt.probe_ewma_ms, peak_ms, tgt.last_ok, tgt.failures = row
+                if recovering and tgt.healthy:
+                    tgt.slow_start_at = now
+                # this worker's own live samples are fresher than the leader's view
+                if now - tgt.last_live > LIVE_WINDOW:
+                    tgt.ewma_ms = ewma_ms
+                    tgt.peak_ms = peak_ms
+
+    def rebuild(self):
+        # swap in fresh routing tables; a single attribute store, so readers never see a partial one
+        self._rebuilt = time.monotonic()
+        for g in self.clusters.values():
+            g.table = route_table(g.targets)
+            if g.hedge_pct > 0 and len(g.latencies) >= HEDGE_MIN_SAMPLES:
+                lat = sorted(g.latencies)
+                g.hedge_after_ms = lat[min(len(lat) - 1, int(len(lat) * g.hedge_pct / 100.0))]
+
+    def pick(self, cluster: str) -> Target:
+        g = self.clusters.get(cluster)
+        if not g or not g.table.ranked:
+            raise HTTPException(503, f"No targets configured for {cluster}")
+        tgt = g.strategy.pick(g.table)
+        if tgt.breaker != CLOSED or tgt.slow_start_at:
+            tgt = self.admit(g, tgt)
+        return tgt
+
+    def admit(self, g: ClusterState, tgt: Target) -> Target:
+        # slow path for targets with an open/half-open breaker or in slow start:
+        # let through only their share, otherwise fall back to the next-best target
+        if breaker_admits(tgt) and (not tgt.slow_start_at or random.random() < ramp(tgt)):
+            return tgt
+        return self.pick_other(g, [tgt]) or tgt
+
+    def pick_other(self, g: ClusterState, exclude: list[Target]) -> Target | None:
+        # next-best target (ranked order) not tried yet; used for retries, hedges and admission
+        for tgt in g.table.ranked:
+            if breaker_admits(tgt) and all(tgt is not x for x in exclude):
+                return tgt
+        return None
+
+    def snapshot(self):
+        out = {}
+        for name, g in self.clusters.items():
+            out[name] = [
+                {"url": t.url, "state": target_state(t), "healthy": t.healthy, "ewma_ms": round(t.ewma_ms, 1),
+                 "last_ms": round(t.last_ms, 1), "failures": t.failures, "inflight": t.inflight,
+                 "probe_ewma_ms": round(t.probe_ewma_ms, 1),
+                 "live_ewma_ms": round(t.live_ewma_ms, 1) if t.live_samples else None,
+                 "live_last_ms": round(t.live_last_ms, 1) if t.live_samples or t.live_errors else None,
+                 "live_samples": t.live_samples, "live_errors": t.live_errors,
+                 "next_probe_in_s": round(max(0.0, t.next_probe - time.monotonic()), 1),
+                 "ejections": t.ejections,
+                 "ejected_for_s": round(max(0.0, t.ejected_until - time.monotonic()), 1) if t.ejected_until else None,
+                 "breaker": t.breaker,
+                 "slow_start_share": round(ramp(t), 2) if t.slow_start_at else None,
+                 "last_ok_s_ago": None if t.last_ok == 0 else round(time.time()-t.last_ok,1)}
+                for t in g.targets
+            ]
+        return out
+
+    def render_metrics(self) -> str:
+        out: list[str] = []
+        groups = list(self.clusters.values())
+        targets = [t for g in groups for t in g.targets]
+        metric_header("lb_requests_total", out)
+        for t in targets:
+            for code, n in sorted(t.metrics.codes.items()):
+                out.append(f'lb_requests_total{{{t.metrics.labels},code="{code}"}} {n}')
+        metric_header("lb_errors_total", out)
+        for t in targets:
+            for kind, n in sorted(t.metrics.errors.items()):
+                out.append(f'lb_errors_total{{{t.metrics.labels},kind="{kind}"}} {n}')
+        metric_header("lb_gateway_errors_total", out)
+        for g in groups:
+            out.append(f"lb_gateway_errors_total{{{g.metrics.labels}}} {g.metrics.gateway_errors}")
+        metric_header("lb_selections_total", out)
+        for t in targets:
+            out.append(f"lb_selections_total{{{t.metrics.labels}}} {t.metrics.selected}")
+        metric_header("lb_retries_total", out)
+        for g in groups:
+            out.append(f"lb_retries_total{{{g.metrics.labels}}} {g.retries}")
+        metric_header("lb_shed_total", out)
+        for g in groups:
+            out.append(f"lb_shed_total{{{g.metrics.labels}}} {0 if g.admission is None else g.admission.shed}")
+        metric_header("lb_hedges_total", out)
+        for g in groups:
+            out.append(f"lb_hedges_total{{{g.metrics.labels}}} {g.hedges}")
+        metric_header("lb_inflight", out)
+        for t in targets:
+            out.append(f"lb_inflight{{{t.metrics.labels}}} {t.inflight}")
+        metric_header("lb_target_healthy", out)
+        for t in targets:
+            out.append(f"lb_target_healthy{{{t.metrics.labels}}} {int(t.healthy)}")
+        metric_header("lb_target_ewma_seconds", out)
+        for t in targets:
+            out.append(f"lb_target_ewma_seconds{{{t.metrics.labels}}} {t.ewma_ms / 1000:.6f}")
+        metric_header("lb_upstream_latency_seconds", out)
+        for t in targets:
+            t.metrics.latency.render("lb_upstream_latency_seconds", t.metrics.labels, out)
+        metric_header("lb_cluster_latency_seconds", out)
+        for g in groups:
+            g.metrics.latency.render("lb_cluster_latency_seconds", g.metrics.labels, out)
+        metric_header("lb_probe_duration_seconds", out)
+        for t in targets:
+            t.metrics.probe.render("lb_probe_duration_seconds", t.metrics.labels, out)
+        return "\n".join(out) + "\n"
+
+    def cluster_stats(self) -> dict:
+        return {
+            name: {"strategy": g.strategy.name, "retries": g.retries, "retries_denied": g.budget.denied,
+                   "ejections": g.ejections, "breaker_trips": g.breaker_trips,
+                   "hedges": g.hedges, "hedge_wins": g.hedge_wins,
+                   "hedge_after_ms": None if g.hedge_after_ms is None else round(g.hedge_after_ms, 1),
+                   "cache": None if g.cache is None else g.cache.stats(),
+                   "admission": None if g.admission is None else g.admission.stats()}
+            for name, g in self.clusters.items()
+        }
+
+def make_client() -> httpx.AsyncClient:
+    # one pooled client per LB process; connections to each target stay alive
+    limits = httpx.Limits(
+        max_connections=POOL_SIZE,
+        max_keepalive_connections=POOL_SIZE,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(limits=limits, timeout=TIMEOUT)
+
+def load_config(path: str) -> dict:
+    # raw targets.json; parse_config validates it when it is applied
     with open(path, "r") as f:
         cfg = json.load(f)
-    # sanity: only keep http urls
-    for k, v in list(cfg.items()):
-        cfg[k] = [u for u in v if u.startswith("http://")]
+    if not isinstance(cfg, dict):
+        raise ValueError("targets.json must map cluster names to targets")
     return cfg
 
 app = FastAPI()
+api = app   # stays the FastAPI app when LB_FAST_PATH wraps app, for route_cluster
 state: LBState | None = None
 
 @app.on_event("startup")
 async def _startup():
     global state
-    cfg = load_config(CONFIG_PATH)
-    state = LBState(cfg)
-    asyncio.create_task(state.run_prober())
+    state = LBState({})
+    state.reload(CONFIG_PATH)
+    state.client = make_client()
+    if RELOAD_INTERVAL > 0:
+        asyncio.create_task(state.run_config_watcher(CONFIG_PATH))
+    if SHM_PATH:
+        state.shared = SharedTable(SHM_PATH)
+        state.reload_gen = state.shared.reload_generation()
+        asyncio.create_task(state.run_shared())
+    else:
+        asyncio.create_task(state.run_prober())
+
+@app.on_event("shutdown")
+async def _shutdown():
+    if state is None:
+        return
+    state._stop = True
+    if state.client is not None:
+        await state.client.aclose()
+    if state.shared is not None:
+        state.shared.close()
 
 @app.get("/status")
 async def status():
     assert state is not None
-    snap = await state.snapshot()
+    snap = state.snapshot()
     return JSONResponse(snap)
 
+@app.get("/metrics")
+async def metrics():
+    assert state is not None
+    return PlainTextResponse(state.render_metrics(), media_type="text/plain; version=0.0.4")
 
-async def forward(url: str) -> Response:
-    try: # <--- ADD THIS
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url, timeout=TIMEOUT)
-            return Response(
-                content=r.content,
-                status_code=r.status_code,
-                media_type=r.headers.get("content-type", "application/json")
-            )
+@app.post("/admin/reload")
+async def admin_reload():
+    assert state is not None
+    try:
+        diff = state.reload(CONFIG_PATH)
+    except (OSError, ValueError) as e:
+        raise HTTPException(400, f"Could not load {CONFIG_PATH}: {e}")
+    if state.shared is not None:
+        # the other workers reload on their next poll of the shared table (LB_SHM_POLL)
+        state.reload_gen = state.shared.bump_reload()
+    return JSONResponse({**diff, "clusters": {name: len(g.targets) for name, g in state.clusters.items()},
+                         "workers": "all" if state.shared is not None else "this"})
+
+@app.get("/status/clusters")
+async def status_clusters():
+    assert state is not None
+    return JSONResponse(state.cluster_stats())
+
+@app.get("/status/config")
+async def status_config():
+    # effective settings benchmark.py stores with each run, plus every LB_* variable that was set
+    return JSONResponse({
+        "LB_PROBE_INTERVAL": PROBE_INTERVAL, "LB_EWMA_ALPHA": ALPHA, "LB_TIMEOUT": TIMEOUT,
+        "LB_STRATEGY": STRATEGY, "env": {k: v for k, v in sorted(os.environ.items()) if k.startswith("LB_")},
+    })
+
+
+def relay_headers(r: httpx.Response, body_len: int | None = None) -> list[tuple[bytes, bytes]]:
+    # upstream headers as-is (duplicates such as set-cookie included), minus hop-by-hop ones
+    headers = [(k.lower(), v) for k, v in r.headers.raw if k.lower() not in HOP_BY_HOP]
+    if body_len is not None and r.status_code not in (204, 304):
+        headers = [h for h in headers if h[0] != b"content-length"]
+        headers.append((b"content-length", str(body_len).encode()))
+    return headers
+
+class HostSaturated(httpx.PoolTimeout):
+    # no free LB_MAX_PER_HOST slot for the target within LB_TIMEOUT
+    pass
+
+RETRYABLE = (httpx.ConnectError, httpx.ConnectTimeout, HostSaturated)  # request never reached the target
+
+@dataclass
+class Upstream:
+    tgt: Target
+    r: httpx.Response
+    admission: Admission | None = None   # cluster slot held until the body has been relayed
+    closed: bool = False
+
+    async def close(self):
+        # safe to call more than once; slots first: they are plain bookkeeping, and must not
+        # depend on aclose() finishing (it can be cancelled when the client has gone away)
+        if self.closed:
+            return
+        self.closed = True
+        release(self.tgt)
+        if self.admission is not None:
+            self.admission.release()
+        await self.r.aclose()
+
+class Relay(StreamingResponse):
+    # streamed upstream body; up is closed however the response ends: fully sent, upstream
+    # error mid-body, or the client disconnecting, even before the first chunk (Starlette
+    # then cancels the response while the headers go out and the body iterator never starts)
+    def __init__(self, up: Upstream):
+        super().__init__(up.r.aiter_raw(), status_code=up.r.status_code)
+        self.raw_headers = relay_headers(up.r)
+        self.up = up
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.up.close()
+
+async def acquire(tgt: Target):
+    tgt.inflight += 1
+    if tgt.sem is not None:
+        try:
+            if tgt.sem.locked():
+                # saturated: wait for a slot, but no longer than a request may take anyway
+                await asyncio.wait_for(tgt.sem.acquire(), TIMEOUT)
+            else:
+                await tgt.sem.acquire()
+        except asyncio.TimeoutError:
+            tgt.inflight -= 1
+            raise HostSaturated(f"No free connection to {tgt.url} within {TIMEOUT:g}s") from None
+        except BaseException:
+            tgt.inflight -= 1
+            raise
+
+def release(tgt: Target):
+    tgt.inflight -= 1
+    if tgt.sem is not None:
+        tgt.sem.release()
+
+async def send_to(g: ClusterState, tgt: Target, query: str, headers: dict) -> Upstream:
+    assert state is not None and state.client is not None
+    url = f"{tgt.url}?{query}" if query else tgt.url
+    # the clock starts before the per-host slot, so time queued behind a saturated target
+    # counts against its latency and the latency-based strategies move away from it
+    t0 = time.perf_counter()
+    try:
+        await acquire(tgt)
+    except HostSaturated as e:
+        tgt.ewma_ms = LIVE_ALPHA * (time.perf_counter() - t0) * 1000.0 + (1.0 - LIVE_ALPHA) * tgt.ewma_ms
+        if METRICS:
+            tgt.metrics.error(type(e).__name__)
+        raise
+    try:
+        req = state.client.build_request("GET", url, headers=headers)
+        r = await state.client.send(req, stream=True)
     except httpx.RequestError as e:
         # This catches connection errors, timeouts, etc.
-        error_content = {"error": "Gateway Error", "detail": str(e)}
-        return JSONResponse(status_code=503, content=error_content)
+        dt = (time.perf_counter() - t0) * 1000.0
+        state.observe(g, tgt, dt, False)
+        if g.admission is not None:
+            g.admission.sample(dt, False)
+        if METRICS:
+            tgt.metrics.error(type(e).__name__)
+        release(tgt)
+        raise
+    except BaseException:
+        release(tgt)
+        raise
+    dt = (time.perf_counter() - t0) * 1000.0
+    state.observe(g, tgt, dt, r.status_code < 500)
+    g.latencies.append(dt)
+    if g.admission is not None:
+        g.admission.sample(dt, r.status_code < 500)
+    if METRICS:
+        tgt.metrics.response(r.status_code, dt)
+        g.metrics.latency.observe(dt)
+    return Upstream(tgt, r)
 
+def _discard(task: asyncio.Task):
+    # cancel a losing attempt; if it already got a response, close it
+    def done(t: asyncio.Task):
+        if not t.cancelled() and t.exception() is None:
+            asyncio.ensure_future(t.result().close())
+    task.cancel()
+    task.add_done_callback(done)
 
-@app.get("/cluster1")
-async def cluster1():
+async def send_hedged(g: ClusterState, tgt: Target, query: str, headers: dict, tried: list[Target]) -> Upstream:
+    # a hedge target is added to tried, so a retry after both attempts failed skips it too
     assert state is not None
-    tgt = await state.pick_fastest("cluster1")
-    return await forward(tgt.url)
+    delay = g.hedge_after_ms
+    if delay is None:
+        return await send_to(g, tgt, query, headers)
+    tasks = {asyncio.create_task(send_to(g, tgt, query, headers))}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay / 1000.0)
+        if done:
+            return tasks.pop().result()
+        alt = state.pick_other(g, [tgt])
+        if alt is None or not g.budget.withdraw():
+            return await tasks.pop()
+        g.hedges += 1
+        tried.append(alt)
+        hedge = asyncio.create_task(send_to(g, alt, query, headers))
+        tasks.add(hedge)
+        error: BaseException | None = None
+        while tasks:
+            done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    for loser in tasks:
+                        _discard(loser)
+                    tasks = set()
+                    for extra in done - {task}:
+                        _discard(extra)
+                    if task is hedge:
+                        g.hedge_wins += 1
+                    return task.result()
+                error = error or task.exception()
+        assert error is not None
+        raise error
+    except BaseException:
+        for task in tasks:
+            _discard(task)
+        raise
 
-@app.get("/cluster2")
-async def cluster2():
+async def fetch(cluster: str, query: str, accept_encoding: str) -> Upstream:
+    # one upstream response, retrying connect errors on the next-best target within budget
     assert state is not None
-    tgt = await state.pick_fastest("cluster2")
-    return await forward(tgt.url)
+    g = state.clusters.get(cluster)
+    adm = g.admission if g is not None else None
+    if adm is not None and not await adm.acquire():
+        raise Overloaded(cluster, RETRY_AFTER)
+    try:
+        up = await fetch_admitted(cluster, query, accept_encoding)
+    except BaseException:
+        if adm is not None:
+            adm.release()
+        raise
+    up.admission = adm
+    return up
+
+async def fetch_admitted(cluster: str, query: str, accept_encoding: str) -> Upstream:
+    assert state is not None
+    tgt = state.pick(cluster)
+    g = state.clusters[cluster]
+    g.budget.deposit()
+    if METRICS:
+        tgt.metrics.selected += 1
+    # body bytes are relayed undecoded, so only ask upstream for encodings the client accepts
+    headers = {"accept-encoding": accept_encoding or "identity"}
+    tried = [tgt]
+    retries = 0
+    while True:
+        try:
+            return await send_hedged(g, tgt, query, headers, tried)
+        except RETRYABLE:
+            if retries >= RETRIES:
+                raise
+            nxt = state.pick_other(g, tried)
+            if nxt is None or not g.budget.withdraw():
+                raise
+            g.retries += 1
+            retries += 1
+            tgt = nxt
+            tried.append(tgt)
+
+async def fetch_entry(cluster: str, query: str, accept_encoding: str) -> Entry:
+    # buffered upstream response, in the form the micro-cache stores
+    up = await fetch(cluster, query, accept_encoding)
+    try:
+        body = b"".join([chunk async for chunk in up.r.aiter_raw()])
+    finally:
+        await up.close()
+    headers = relay_headers(up.r, len(body))
+    return Entry(
+        status=up.r.status_code,
+        headers=headers,
+        body=body,
+        cacheable=cacheable(up.r.status_code, headers),
+    )
+
+async def lookup(g: ClusterState, path: str, query: str, accept_encoding: str) -> tuple[Entry, str]:
+    assert g.cache is not None
+    # raw bodies may be compressed, so the accepted encodings are part of the key
+    key = f"GET {path}?{query}|{accept_encoding}"
+    return await g.cache.get_or_fetch(key, lambda: fetch_entry(g.name, query, accept_encoding))
+
+def overloaded(e: Overloaded) -> Response:
+    content = {"error": "Overloaded", "detail": str(e)}
+    return JSONResponse(status_code=503, content=content, headers={"Retry-After": str(e.retry_after)})
+
+async def forward_cached(g: ClusterState, request: Request) -> Response:
+    try:
+        e, how = await lookup(g, request.url.path, request.url.query, request.headers.get("accept-encoding", ""))
+    except Overloaded as exc:
+        return overloaded(exc)
+    except httpx.RequestError as exc:
+        if METRICS:
+            g.metrics.gateway_errors += 1
+        error_content = {"error": "Gateway Error", "detail": str(exc)}
+        return JSONResponse(status_code=503, content=error_content)
+    resp = Response(content=e.body, status_code=e.status)
+    resp.raw_headers = e.headers + [(b"x-cache", how.encode())]
+    return resp
+
+async def forward(cluster: str, request: Request) -> Response:
+    assert state is not None
+    g = state.clusters.get(cluster)
+    if g is not None and g.cache is not None:
+        return await forward_cached(g, request)
+    try:
+        up = await fetch(cluster, request.url.query, request.headers.get("accept-encoding", ""))
+    except Overloaded as e:
+        return overloaded(e)
+    except httpx.RequestError as e:
+        if METRICS and g is not None:
+            g.metrics.gateway_errors += 1
+        error_content = {"error": "Gateway Error", "detail": str(e)}
+        return JSONResponse(status_code=503, content=error_content)
+    r = up.r
+
+    if not STREAMING:
+        try:
+            body = b"".join([chunk async for chunk in r.aiter_raw()])
+        except httpx.RequestError as e:
+            error_content = {"error": "Gateway Error", "detail": str(e)}
+            return JSONResponse(status_code=503, content=error_content)
+        finally:
+            await up.close()
+        resp = Response(content=body, status_code=r.status_code)
+        resp.raw_headers = relay_headers(r, len(body))
+        return resp
+
+    # headers go out as soon as upstream answers; the body follows chunk by chunk
+    return Relay(up)
+
+ROUTES: dict[str, str] = {}   # proxy path -> cluster, for every cluster configured so far
+
+def route_cluster(name: str):
+    # GET /<cluster>, added the first time the cluster shows up in targets.json; a cluster
+    # removed later keeps its route, which answers 503 until it has targets again
+    path = f"/{name}"
+    if path in ROUTES:
+        return
+
+    async def proxy(request: Request):
+        assert state is not None
+        return await forward(name, request)
+    api.add_api_route(path, proxy, methods=["GET"], name=name)
+    ROUTES[path] = name
+
+if FAST_PATH:
+    # raw ASGI handling of the proxy routes; FastAPI still serves everything else
+    from fastpath import FastPath
+    app = FastPath(app)
@@ -0,0 +1,77 @@
+# lb/metrics.py
+# Minimal Prometheus text-format metrics. Recording is a few attribute updates and a
+# bisect on a fixed bucket list, done inline on the request path (no locks: one event loop).
+# Every uvicorn worker keeps its own, so each series carries a worker="<pid>" label: scrapes that
+# land on different workers are then separate series rather than counters jumping backwards.
+import bisect, os
+
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class Histogram:
+    __slots__ = ("counts", "sum", "n")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.n = 0
+
+    def observe(self, ms: float):
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.sum += ms
+        self.n += 1
+
+    def render(self, name: str, labels: str, out: list[str]):
+        acc = 0
+        for le, c in zip(BUCKETS_MS, self.counts):
+            acc += c
+            out.append(f'{name}_bucket{{{labels},le="{le / 1000:g}"}} {acc}')
+        out.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.n}')
+        out.append(f"{name}_sum{{{labels}}} {self.sum / 1000:.6f}")
+        out.append(f"{name}_count{{{labels}}} {self.n}")
+
+class TargetMetrics:
+    __slots__ = ("labels", "codes", "errors", "latency", "probe", "selected")
+
+    def __init__(self, cluster: str, url: str):
+        self.labels = f'cluster="{cluster}",target="{url}",worker="{os.getpid()}"'
+        self.codes: dict[int, int] = {}
+        self.errors: dict[str, int] = {}
+        self.latency = Histogram()
+        self.probe = Histogram()
+        self.selected = 0
+
+    def response(self, code: int, ms: float):
+        self.codes[code] = self.codes.get(code, 0) + 1
+        self.latency.observe(ms)
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+class ClusterMetrics:
+    __slots__ = ("labels", "latency", "gateway_errors")
+
+    def __init__(self, cluster: str):
+        self.labels = f'cluster="{cluster}",worker="{os.getpid()}"'
+        self.latency = Histogram()
+        self.gateway_errors = 0
+
+HELP = {
+    "lb_requests_total": ("counter", "Upstream responses by target and status code"),
+    "lb_errors_total": ("counter", "Upstream transport errors by target and exception"),
+    "lb_gateway_errors_total": ("counter", "Requests answered with a gateway error by the LB"),
+    "lb_selections_total": ("counter", "Times a target was chosen by the selection strategy"),
+    "lb_retries_total": ("counter", "Retries sent to a sibling target"),
+    "lb_hedges_total": ("counter", "Hedged requests sent"),
+    "lb_shed_total": ("counter", "Requests rejected by admission control"),
+    "lb_inflight": ("gauge", "Proxied requests currently outstanding"),
+    "lb_target_healthy": ("gauge", "1 if the target is considered healthy"),
+    "lb_target_ewma_seconds": ("gauge", "Latency EWMA used for selection"),
+    "lb_upstream_latency_seconds": ("histogram", "Time to upstream response headers, per target"),
+    "lb_cluster_latency_seconds": ("histogram", "Time to upstream response headers, per cluster"),
+    "lb_probe_duration_seconds": ("histogram", "Health probe duration, per target"),
+}
+
+def header(name: str, out: list[str]):
+    kind, text = HELP[name]
+    out.append(f"# HELP {name} {text}")
+    out.append(f"# TYPE {name} {kind}")
@@ -0,0 +1,83 @@
+# lb/shared.py
+# Target health/latency table shared by the uvicorn workers of one LB box.
+#
+# One worker (whoever holds the flock on <path>.lock) runs the prober and publishes
+# into a fixed-layout mmap; the others only read it. Writes use a seqlock: the
+# sequence number is odd while a write is in progress, so readers retry instead
+# of seeing a half-written table. After the records sits a counter that any worker bumps
+# on POST /admin/reload, so the other workers know to reload the config too.
+import fcntl, mmap, os, struct, typing as t
+
+HEADER = struct.Struct("<QI")              # seq, record count
+RECORD = struct.Struct("<256s?dddddI")     # url, healthy, ewma_ms, last_ms, probe_ewma_ms, peak_ms, last_ok, failures
+GEN = struct.Struct("<Q")                  # config reload generation
+SLOTS = int(os.getenv("LB_SHM_SLOTS", "512"))
+
+Row = tuple[str, bool, float, float, float, float, float, int]
+
+class SharedTable:
+    def __init__(self, path: str, slots: int = SLOTS):
+        self.slots = slots
+        self.gen_at = HEADER.size + slots * RECORD.size
+        self.size = self.gen_at + GEN.size
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            if os.fstat(fd).st_size < self.size:
+                os.ftruncate(fd, self.size)
+            self.mm = mmap.mmap(fd, self.size)
+        finally:
+            os.close(fd)
+        self.lock_fd = os.open(path + ".lock", os.O_RDWR | os.O_CREAT, 0o600)
+        self.leader = False
+
+    def try_lead(self) -> bool:
+        # non-blocking; the lock is dropped by the kernel when the leader process dies,
+        # so another worker takes over probing on its next poll
+        if not self.leader:
+            try:
+                fcntl.flock(self.lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                self.leader = True
+            except BlockingIOError:
+                pass
+        return self.leader
+
+    def publish(self, rows: t.Iterable[Row]):
+        assert self.leader
+        rows = list(rows)[: self.slots]
+        seq, _ = HEADER.unpack_from(self.mm, 0)
+        if seq % 2:
+            seq += 1  # previous leader died mid-write
+        HEADER.pack_into(self.mm, 0, seq + 1, len(rows))
+        for i, (url, *rest) in enumerate(rows):
+            RECORD.pack_into(self.mm, HEADER.size + i * RECORD.size, url.encode(), *rest)
+        HEADER.pack_into(self.mm, 0, seq + 2, len(rows))
+
+    def read(self, retries: int = 100) -> dict[str, Row] | None:
+        # consistent copy of the table keyed by url, or None if the leader kept writing
+        for _ in range(retries):
+            seq1, n = HEADER.unpack_from(self.mm, 0)
+            if seq1 == 0 or seq1 % 2:
+                continue
+            buf = self.mm[HEADER.size : HEADER.size + min(n, self.slots) * RECORD.size]
+            seq2, _ = HEADER.unpack_from(self.mm, 0)
+            if seq1 != seq2:
+                continue
+            out = {}
+            for rec in RECORD.iter_unpack(buf):
+                url = rec[0].rstrip(b"\0").decode()
+                out[url] = (url, *rec[1:])
+            return out
+        return None
+
+    def reload_generation(self) -> int:
+        return GEN.unpack_from(self.mm, self.gen_at)[0]
+
+    def bump_reload(self) -> int:
+        # two concurrent bumps may both write n+1; either way every other worker sees a change
+        gen = self.reload_generation() + 1
+        GEN.pack_into(self.mm, self.gen_at, gen)
+        return gen
+
+    def close(self):
+        self.mm.close()
+        os.close(self.lock_fd)
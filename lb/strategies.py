@@ -0,0 +1,133 @@
+# Target selection strategies and the routing table they read.
+# A strategy is a Strategy subclass registered under one or more names with @register; each
+# cluster gets its own instance (so a strategy may keep state, e.g. a round-robin cursor), chosen
+# by LB_STRATEGY_<CLUSTER>, the cluster's "strategy" in targets.json, or LB_STRATEGY.
+# Nothing here imports FastAPI or httpx: scripts/bench_select.py times every registered
+# strategy on plain objects, so a new one can be measured before it is deployed.
+import abc, bisect, random, typing as t
+from dataclasses import dataclass
+
+if t.TYPE_CHECKING:
+    from lb import Target
+
+@dataclass(frozen=True)
+class RouteTable:
+    # immutable per-cluster snapshot built by the prober; the request path only reads it
+    ranked: tuple["Target", ...] = ()     # candidates, fastest first
+    cum_weights: tuple[float, ...] = ()   # running sum of 1/ewma_ms over ranked
+    total: float = 0.0
+
+    @classmethod
+    def from_ranked(cls, ranked: tuple["Target", ...]) -> "RouteTable":
+        cum, acc = [], 0.0
+        for tgt in ranked:
+            acc += 1.0 / max(tgt.ewma_ms, 0.1)
+            cum.append(acc)
+        return cls(ranked=ranked, cum_weights=tuple(cum), total=acc)
+
+class Strategy(abc.ABC):
+    # pick() gets a non-empty table and must not block, lock or allocate per call if it can help it
+    def __init__(self, name: str):
+        self.name = name   # as configured, so /status/clusters shows what was asked for
+
+    @abc.abstractmethod
+    def pick(self, table: RouteTable) -> "Target":
+        ...
+
+STRATEGIES: dict[str, type[Strategy]] = {}
+
+def register(*names: str):
+    def add(cls: type[Strategy]) -> type[Strategy]:
+        # caught at import rather than on the first request routed to the strategy
+        if getattr(cls, "__abstractmethods__", None):
+            raise TypeError(f"Strategy {cls.__name__} does not implement {', '.join(sorted(cls.__abstractmethods__))}")
+        for name in names:
+            if name in STRATEGIES:
+                raise ValueError(f"Strategy {name!r} is already registered")
+            STRATEGIES[name] = cls
+        return cls
+    return add
+
+def make_strategy(name: str) -> Strategy:
+    if name not in STRATEGIES:
+        raise ValueError(f"Unknown LB strategy {name!r}; choose from {sorted(STRATEGIES)}")
+    return STRATEGIES[name](name)
+
+# O(1) (weighted: O(log n)) reads of a RouteTable. ranked holds the healthy subset
+# (or every target if none is healthy).
+
+def _two(table: RouteTable) -> tuple["Target", "Target"]:
+    n = len(table.ranked)
+    i = random.randrange(n)
+    j = random.randrange(n - 1)
+    if j >= i:
+        j += 1
+    return table.ranked[i], table.ranked[j]
+
+@register("ewma_min", "fastest")
+class EwmaMin(Strategy):
+    # min ewma (tie-breaker last_ms) as of the last table rebuild
+    def pick(self, table):
+        return table.ranked[0]
+
+@register("round_robin")
+class RoundRobin(Strategy):
+    # each target in turn, ignoring latency. ranked is re-sorted on every rebuild, so the
+    # rotation uses its own order by URL, recomputed once per table rather than per pick
+    def __init__(self, name: str):
+        super().__init__(name)
+        self.next = 0
+        self.table: RouteTable | None = None
+        self.order: tuple["Target", ...] = ()
+
+    def pick(self, table):
+        if table is not self.table:
+            self.table = table
+            self.order = tuple(sorted(table.ranked, key=lambda t: t.url))
+        self.next += 1
+        return self.order[self.next % len(self.order)]
+
+@register("random")
+class RandomChoice(Strategy):
+    def pick(self, table):
+        return table.ranked[random.randrange(len(table.ranked))]
+
+@register("p2c")
+class PowerOfTwo(Strategy):
+    # power of two choices: sample two, keep the faster one (live ewma)
+    def pick(self, table):
+        if len(table.ranked) == 1:
+            return table.ranked[0]
+        a, b = _two(table)
+        return a if a.ewma_ms <= b.ewma_ms else b
+
+@register("weighted_ewma", "weighted")
+class WeightedEwma(Strategy):
+    # latency-inverse weighted random: a 2x faster target gets 2x the traffic
+    def pick(self, table):
+        i = bisect.bisect_right(table.cum_weights, random.random() * table.total)
+        return table.ranked[min(i, len(table.ranked) - 1)]
+
+@register("peak_ewma")
+class PeakEwma(Strategy):
+    # p2c on peak EWMA x outstanding requests: busy targets look slower than their last sample
+    def pick(self, table):
+        if len(table.ranked) == 1:
+            return table.ranked[0]
+        a, b = _two(table)
+        return a if a.peak_ms * (a.inflight + 1) <= b.peak_ms * (b.inflight + 1) else b
+
+# The two below scan ranked (O(n), still lock- and allocation-free): in-flight counts
+# move on every request, so they cannot be baked into the table.
+
+@register("least_connections", "least_outstanding")
+class LeastConnections(Strategy):
+    # fewest in-flight requests; ties go to the faster target (ranked order)
+    def pick(self, table):
+        return min(table.ranked, key=lambda t: t.inflight)
+
+@register("ewma_load")
+class EwmaLoad(Strategy):
+    # expected wait: ewma x (in-flight + 1)
+    def pick(self, table):
+        return min(table.ranked, key=lambda t: t.ewma_ms * (t.inflight + 1))
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+# Compares benchmark records saved by benchmark.py (artifacts/benchmarks/*.json).
+# Every argument is a record file or a directory of them; by default each argument is one run set,
+# records of a set are pooled per cluster, and every set is compared with the first one:
+#   python scripts/bench_compare.py artifacts/benchmarks/base.json artifacts/benchmarks/new.json
+#   python scripts/bench_compare.py before/ after/
+#   python scripts/bench_compare.py artifacts/benchmarks --by strategy --baseline fastest
+# Throughput: Welch's t-test on the per-second throughput samples. p99: bootstrap of the p99
+# ratio, drawn exactly from the pooled histograms (the r-th order statistic of a resample is
+# the empirical quantile at a Beta(r, n-r+1) draw). A change is a regression when it is
+# significant at --alpha and worse than --min-change percent; the exit code is then 1.
+import argparse, bisect, json, math, pathlib, random, sys
+from dataclasses import dataclass, field
+
+from benchmark import Histogram
+
+@dataclass
+class Pool:
+    # all records of one run set for one cluster
+    label: str
+    hist: Histogram = field(default_factory=Histogram)
+    throughput: list[int] = field(default_factory=list)
+    runs: int = 0
+
+    def add(self, record: dict):
+        self.hist.merge(Histogram.from_dict(record["stats"]["hist"]))
+        self.throughput += record["throughput"]
+        self.runs += 1
+
+def load(path: pathlib.Path) -> list[tuple[pathlib.Path, dict]]:
+    files = sorted(path.glob("*.json")) if path.is_dir() else [path]
+    return [(f, json.loads(f.read_text())) for f in files]
+
+def mean_var(xs: list[int]) -> tuple[float, float]:
+    m = sum(xs) / len(xs)
+    return m, sum((x - m) ** 2 for x in xs) / (len(xs) - 1)
+
+def betacf(a: float, b: float, x: float) -> float:
+    # continued fraction of the incomplete beta function (modified Lentz)
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 300):
+        for num in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                    -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + num * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + num / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1.0) < 1e-12:
+            break
+    return h
+
+def betainc(a: float, b: float, x: float) -> float:
+    # regularized incomplete beta I_x(a, b)
+    if x <= 0.0 or x >= 1.0:
+        return max(0.0, min(1.0, x))
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log1p(-x))
+    if x < (a + 1.0) / (a + b + 2.0):
+        return front * betacf(a, b, x) / a
+    return 1.0 - front * betacf(b, a, 1.0 - x) / b
+
+def welch(xs: list[int], ys: list[int]) -> float:
+    # two-sided p-value of Welch's t-test for a difference in means
+    (mx, vx), (my, vy) = mean_var(xs), mean_var(ys)
+    se2 = vx / len(xs) + vy / len(ys)
+    if se2 == 0.0:
+        return 1.0 if mx == my else 0.0
+    t = (my - mx) / math.sqrt(se2)
+    df = se2 ** 2 / ((vx / len(xs)) ** 2 / (len(xs) - 1) + (vy / len(ys)) ** 2 / (len(ys) - 1))
+    return betainc(df / 2.0, 0.5, df / (df + t * t))
+
+class Quantiles:
+    # empirical quantile function of a histogram, in ms
+    def __init__(self, h: Histogram):
+        self.values, self.cum = [], []
+        acc = 0
+        for i in sorted(h.counts):
+            acc += h.counts[i]
+            self.values.append(min(h.value(i), h.max_us) / 1000.0)
+            self.cum.append(acc)
+        self.n = acc
+
+    def at_rank(self, r: int) -> float:
+        return self.values[bisect.bisect_left(self.cum, r)]
+
+    def bootstrap(self, p: float, rng: random.Random) -> float:
+        # p-th percentile of one bootstrap resample
+        r = max(1, int(round(p / 100.0 * self.n)))
+        u = rng.betavariate(r, self.n - r + 1)
+        return self.at_rank(max(1, math.ceil(u * self.n)))
+
+def ratio_ci(base: Histogram, new: Histogram, p: float, reps: int, rng: random.Random) -> tuple[float, float]:
+    qb, qn = Quantiles(base), Quantiles(new)
+    ratios = sorted(qn.bootstrap(p, rng) / max(qb.bootstrap(p, rng), 1e-3) for _ in range(reps))
+    return ratios[int(0.025 * reps)], ratios[min(reps - 1, int(0.975 * reps))]
+
+@dataclass
+class Verdict:
+    rps_change: float | None = None   # percent
+    rps_p: float | None = None
+    p99_change: float | None = None   # percent
+    p99_ci: tuple[float, float] | None = None   # percent
+    regressions: list[str] = field(default_factory=list)
+
+def compare(base: Pool, new: Pool, args, rng: random.Random) -> Verdict:
+    v = Verdict()
+    if len(base.throughput) >= 2 and len(new.throughput) >= 2:
+        mb, mn = sum(base.throughput) / len(base.throughput), sum(new.throughput) / len(new.throughput)
+        v.rps_change = 100.0 * (mn - mb) / mb if mb else 0.0
+        v.rps_p = welch(base.throughput, new.throughput)
+        if v.rps_p < args.alpha and v.rps_change < -args.min_change:
+            v.regressions.append("throughput")
+    if base.hist.n and new.hist.n:
+        pb, pn = base.hist.percentile(99), new.hist.percentile(99)
+        v.p99_change = 100.0 * (pn - pb) / pb if pb else 0.0
+        lo, hi = ratio_ci(base.hist, new.hist, 99, args.bootstrap, rng)
+        v.p99_ci = (100.0 * (lo - 1), 100.0 * (hi - 1))
+        if v.p99_ci[0] > 0 and v.p99_change > args.min_change:
+            v.regressions.append("p99")
+    return v
+
+def fmt(x: float | None, spec: str) -> str:
+    return "-" if x is None else format(x, spec)
+
+def group_key(record: dict, by: str, arg: str) -> str:
+    if by == "arg":
+        path = pathlib.Path(arg)
+        return path.name if path.is_dir() else path.stem
+    return str(record.get(by) or "unknown")
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description="Compare saved benchmark runs and flag regressions.")
+    p.add_argument("runs", nargs="+", help="record files or directories of records")
+    p.add_argument("--by", choices=["arg", "strategy", "label", "git_rev"], default="arg",
+                   help="what makes a run set (default: each argument)")
+    p.add_argument("--baseline", default="", help="run set everything is compared with (default: the first)")
+    p.add_argument("--alpha", type=float, default=0.05, help="significance level")
+    p.add_argument("--min-change", type=float, default=5.0, help="smallest change in percent that counts")
+    p.add_argument("--bootstrap", type=int, default=2000, help="bootstrap resamples for the p99 interval")
+    p.add_argument("--seed", type=int, default=1)
+    return p.parse_args(argv)
+
+def main(argv=None) -> int:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    sets: dict[str, dict[str, Pool]] = {}   # run set -> cluster -> pool
+    for arg in args.runs:
+        for path, record in load(pathlib.Path(arg)):
+            key = group_key(record, args.by, arg)
+            pool = sets.setdefault(key, {}).setdefault(record["cluster"], Pool(key))
+            pool.add(record)
+    if not sets:
+        sys.exit("No benchmark records found")
+    base_key = args.baseline or next(iter(sets))
+    if base_key not in sets:
+        sys.exit(f"Baseline {base_key!r} not found; run sets: {', '.join(sets)}")
+    rng = random.Random(args.seed)
+
+    regressed = []
+    clusters = sorted({c for pools in sets.values() for c in pools})
+    for cluster in clusters:
+        base = sets[base_key].get(cluster)
+        if base is None:
+            print(f"\n{cluster}: no baseline run in {base_key!r}, skipped")
+            continue
+        print(f"\n{cluster} (baseline {base_key}, {base.runs} run(s))")
+        print(f"  {'run set':<40} {'runs':>4} {'req/s':>9} {'Δ':>7} {'p':>7} {'p99 ms':>8} {'Δ':>7} "
+              f"{'95% CI':>17}  verdict")
+        for key, pools in sets.items():
+            pool = pools.get(cluster)
+            if pool is None:
+                continue
+            rps = sum(pool.throughput) / len(pool.throughput) if pool.throughput else None
+            p99 = pool.hist.percentile(99)
+            if key == base_key:
+                print(f"  {key[-40:]:<40} {pool.runs:>4} {fmt(rps, '9.1f')} {'':>7} {'':>7} {p99:8.2f}")
+                continue
+            v = compare(base, pool, args, rng)
+            ci = "-" if v.p99_ci is None else f"[{v.p99_ci[0]:+.1f}, {v.p99_ci[1]:+.1f}]%"
+            verdict = "REGRESSION: " + ", ".join(v.regressions) if v.regressions else "ok"
+            print(f"  {key[-40:]:<40} {pool.runs:>4} {fmt(rps, '9.1f')} {fmt(v.rps_change, '+6.1f')}% "
+                  f"{fmt(v.rps_p, '7.3f')} {p99:8.2f} {fmt(v.p99_change, '+6.1f')}% {ci:>17}  {verdict}")
+            if v.regressions:
+                regressed.append(f"{cluster} {key}: {', '.join(v.regressions)}")
+    if regressed:
+        print("\nRegressions:\n  " + "\n  ".join(regressed))
+        return 1
+    print("\nNo significant regressions.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# Microbenchmark: CPU cost of the /metrics recording done per proxied request.
+# For an end-to-end number, run the LB benchmark with LB_METRICS=1 and LB_METRICS=0.
+import pathlib, random, sys, timeit
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "lb"))
+from metrics import ClusterMetrics, TargetMetrics  # noqa: E402
+
+NUMBER = 500_000
+
+def main():
+    tm = TargetMetrics("cluster1", "http://10.0.0.1:8000/cluster1")
+    cm = ClusterMetrics("cluster1")
+    samples = [random.lognormvariate(1.5, 0.8) for _ in range(1024)]
+    it = iter(range(1 << 62))
+
+    def record():
+        # exactly what one proxied request records: selection, status + latency, cluster latency
+        dt = samples[next(it) & 1023]
+        tm.selected += 1
+        tm.response(200, dt)
+        cm.latency.observe(dt)
+
+    def baseline():
+        dt = samples[next(it) & 1023]
+        return dt
+
+    rec = min(timeit.repeat(record, number=NUMBER, repeat=5)) / NUMBER
+    base = min(timeit.repeat(baseline, number=NUMBER, repeat=5)) / NUMBER
+    cost_ns = (rec - base) * 1e9
+    print(f"recording per request: {cost_ns:7.0f} ns")
+    for rps in (1_000, 5_000, 20_000):
+        print(f"  at {rps:>6} req/s: {cost_ns * rps / 1e9 * 100:6.3f}% of one core")
+
+    targets = [TargetMetrics("cluster1", f"http://10.0.0.{i}:8000/cluster1") for i in range(8)]
+    for t in targets:
+        for _ in range(1000):
+            t.response(200, random.random() * 20)
+    out: list[str] = []
+
+    def render():
+        out.clear()
+        for t in targets:
+            t.latency.render("lb_upstream_latency_seconds", t.labels, out)
+
+    n = 2_000
+    per = min(timeit.repeat(render, number=n, repeat=3)) / n
+    print(f"rendering 8 target histograms: {per * 1e6:7.1f} us per scrape")
+
+if __name__ == "__main__":
+    main()
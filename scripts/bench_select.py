@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# Microbenchmark: cost of one target selection for every registered strategy, for several cluster
+# sizes. Pure Python: strategies run on stand-in targets and a RouteTable from lb/strategies.py,
+# so neither FastAPI nor httpx is needed, and a new @register'ed strategy shows up here by itself.
+import argparse, pathlib, random, sys, timeit
+from dataclasses import dataclass
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "lb"))
+from strategies import STRATEGIES, RouteTable, make_strategy  # noqa: E402
+
+SIZES = [8, 100, 1000]
+NUMBER = 200_000
+
+@dataclass
+class FakeTarget:
+    # the Target fields strategies read
+    url: str
+    ewma_ms: float
+    last_ms: float
+    peak_ms: float
+    inflight: int
+    healthy: bool
+
+def make_targets(n: int) -> list[FakeTarget]:
+    random.seed(n)
+    targets = []
+    for i in range(n):
+        ewma = random.uniform(1.0, 50.0)
+        targets.append(FakeTarget(f"http://10.0.{i // 250}.{i % 250}:8000/bench", ewma, ewma, ewma,
+                                  random.randrange(8), random.random() > 0.1))
+    return targets
+
+def make_table(targets: list[FakeTarget]) -> RouteTable:
+    # what lb.route_table does, minus draining / ejection / breaker state
+    healthy = [t for t in targets if t.healthy]
+    return RouteTable.from_ranked(tuple(sorted(healthy or targets, key=lambda t: (t.ewma_ms, t.last_ms))))
+
+def legacy_pick(targets: list) -> object:
+    # what pick_fastest did before routing tables (minus the asyncio.Lock)
+    healthy = [t for t in targets if t.healthy]
+    candidates = healthy if healthy else targets
+    return min(candidates, key=lambda t: (t.ewma_ms, t.last_ms))
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description="Time one target selection per strategy.")
+    p.add_argument("strategies", nargs="*", help="registered names to time (default: all)")
+    return p.parse_args(argv)
+
+def main():
+    args = parse_args(sys.argv[1:])
+    unknown = [s for s in args.strategies if s not in STRATEGIES]
+    if unknown:
+        sys.exit(f"Unknown strategies {unknown}; registered: {sorted(STRATEGIES)}")
+    names = ["legacy_scan"] + args.strategies
+    if not args.strategies:
+        # aliases share a class; time each class once, under its first registered name
+        seen = set()
+        for name, cls in STRATEGIES.items():
+            if cls not in seen:
+                seen.add(cls)
+                names.append(name)
+    width = max(len(n) for n in names) + 2
+    print(f"{'strategy':<{width}}" + "".join(f"{n:>12}" for n in SIZES) + "   (ns per pick)")
+    results: dict[str, list[float]] = {name: [] for name in names}
+    for n in SIZES:
+        targets = make_targets(n)
+        table = make_table(targets)
+        for name in names:
+            if name == "legacy_scan":
+                fn = lambda: legacy_pick(targets)
+            else:
+                fn = lambda pick=make_strategy(name).pick: pick(table)
+            number = NUMBER if name != "legacy_scan" else max(1000, NUMBER * 8 // n)
+            best = min(timeit.repeat(fn, number=number, repeat=3))
+            results[name].append(best / number * 1e9)
+    for name in names:
+        print(f"{name:<{width}}" + "".join(f"{ns:>12.0f}" for ns in results[name]))
+    print("\nRouting-table rebuild (after probes complete):")
+    for n in SIZES:
+        targets = make_targets(n)
+        best = min(timeit.repeat(lambda: make_table(targets), number=200, repeat=3))
+        print(f"  {n:>5} targets: {best / 200 * 1e6:9.1f} us")
+
+if __name__ == "__main__":
+    main()
@@ -1,60 +1,404 @@
 #!/usr/bin/env python3
+import argparse
 import asyncio
 import aiohttp
+import copy
+import datetime
+import json
+import multiprocessing
+import os
+import pathlib
+import subprocess
 import time
 import sys
+import urllib.request
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
-async def call_endpoint(session, url, request_num):
+# Log-linear histogram of latencies in microseconds (HDR-style): exact below 2^SUB_BITS us,
+# then 2^(SUB_BITS-1) sub-buckets per power of two, i.e. < 0.8% relative error.
+SUB_BITS = 8
+
+class Histogram:
+    def __init__(self):
+        self.counts: Counter = Counter()
+        self.n = 0
+        self.sum_us = 0
+        self.max_us = 0
+
+    @staticmethod
+    def index(us: int) -> int:
+        if us < (1 << SUB_BITS):
+            return us
+        e = us.bit_length() - SUB_BITS
+        return (e << (SUB_BITS - 1)) + (us >> e)
+
+    @staticmethod
+    def value(i: int) -> int:
+        # lower bound of the bucket's value range
+        if i < (1 << SUB_BITS):
+            return i
+        e = (i >> (SUB_BITS - 1)) - 1
+        return (i - (e << (SUB_BITS - 1))) << e
+
+    def record(self, ms: float):
+        us = max(0, int(ms * 1000))
+        self.counts[self.index(us)] += 1
+        self.n += 1
+        self.sum_us += us
+        self.max_us = max(self.max_us, us)
+
+    def merge(self, other: "Histogram"):
+        self.counts.update(other.counts)
+        self.n += other.n
+        self.sum_us += other.sum_us
+        self.max_us = max(self.max_us, other.max_us)
+
+    def percentile(self, p: float) -> float:
+        # in ms
+        if not self.n:
+            return 0.0
+        rank = max(1, int(round(p / 100.0 * self.n)))
+        acc = 0
+        for i in sorted(self.counts):
+            acc += self.counts[i]
+            if acc >= rank:
+                return min(self.value(i), self.max_us) / 1000.0
+        return self.max_us / 1000.0
+
+    def mean(self) -> float:
+        return self.sum_us / self.n / 1000.0 if self.n else 0.0
+
+    def to_dict(self) -> dict:
+        return {"sub_bits": SUB_BITS, "n": self.n, "sum_us": self.sum_us, "max_us": self.max_us,
+                "counts": sorted(self.counts.items())}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "Histogram":
+        h = cls()
+        h.counts = Counter({int(i): c for i, c in d["counts"]})
+        h.n, h.sum_us, h.max_us = d["n"], d["sum_us"], d["max_us"]
+        return h
+
+class RunStats:
+    def __init__(self):
+        self.hist = Histogram()
+        self.server = Histogram()    # X-Server-Time-Ms reported by the app, when present
+        self.errors: Counter = Counter()
+        self.per_instance: Counter = Counter()
+        self.per_second: Counter = Counter()    # successful responses per wall-clock second
+        self.ok = 0
+        self.elapsed = 0.0
+
+    def merge(self, other: "RunStats"):
+        self.hist.merge(other.hist)
+        self.server.merge(other.server)
+        self.errors.update(other.errors)
+        self.per_instance.update(other.per_instance)
+        self.per_second.update(other.per_second)
+        self.ok += other.ok
+        self.elapsed = max(self.elapsed, other.elapsed)
+
+    def throughput(self) -> list[int]:
+        # successful responses per second, first and last (partial) seconds dropped
+        if not self.per_second:
+            return []
+        lo, hi = min(self.per_second), max(self.per_second)
+        return [self.per_second[s] for s in range(lo + 1, hi)]
+
+    def to_dict(self) -> dict:
+        return {"hist": self.hist.to_dict(), "server": self.server.to_dict(), "errors": dict(self.errors),
+                "per_instance": dict(self.per_instance), "per_second": dict(self.per_second),
+                "ok": self.ok, "elapsed": self.elapsed}
+
+    @classmethod
+    def from_dict(cls, d: dict) -> "RunStats":
+        stats = cls()
+        stats.hist = Histogram.from_dict(d["hist"])
+        stats.server = Histogram.from_dict(d["server"])
+        stats.errors = Counter(d["errors"])
+        stats.per_instance = Counter(d["per_instance"])
+        stats.per_second = Counter({int(k): v for k, v in d["per_second"].items()})
+        stats.ok, stats.elapsed = d["ok"], d["elapsed"]
+        return stats
+
+async def call_endpoint(session, url, stats: RunStats, start: float | None = None, record: bool = True):
+    # start is the time the request *should* have been sent (open loop), so queueing
+    # delay inside the load generator counts against latency instead of being hidden
+    t0 = time.perf_counter() if start is None else start
+    instance_id = None
+    error = None
+    server_ms = None
     try:
         async with session.get(url) as response:
-            # We don't need the body, just that it succeeded
+            server_ms = response.headers.get("X-Server-Time-Ms")
             if response.status == 200:
-                return True
+                try:
+                    body = await response.json(content_type=None)
+                    instance_id = body.get("instance_id", "unknown")
+                except ValueError:
+                    instance_id = "unknown"
             else:
-                print(f"Request {request_num}: Failed with status code {response.status}")
-                return False
+                await response.read()
+                error = f"HTTP {response.status}"
     except Exception as e:
-        print(f"Request {request_num}: Failed with exception {e}")
-        return False
+        error = type(e).__name__
+    dt = (time.perf_counter() - t0) * 1000.0
+    if not record:
+        return
+    stats.hist.record(dt)
+    if server_ms is not None:
+        try:
+            stats.server.record(float(server_ms))
+        except ValueError:
+            pass
+    if error is None:
+        stats.ok += 1
+        stats.per_instance[instance_id] += 1
+        stats.per_second[int(time.time())] += 1
+    else:
+        stats.errors[error] += 1
+
+async def run_burst(session, url: str, num_requests: int) -> RunStats:
+    # original mode: everything at once
+    stats = RunStats()
+    start_time = time.perf_counter()
+    await asyncio.gather(*[call_endpoint(session, url, stats) for _ in range(num_requests)])
+    stats.elapsed = time.perf_counter() - start_time
+    return stats
+
+async def run_closed(session, url: str, concurrency: int, duration: float, warmup: float) -> RunStats:
+    # fixed concurrency: each worker sends its next request when the previous one returns
+    stats = RunStats()
+    t_start = time.perf_counter()
+    t_measure = t_start + warmup
+    t_end = t_measure + duration
+
+    async def worker():
+        while True:
+            now = time.perf_counter()
+            if now >= t_end:
+                return
+            await call_endpoint(session, url, stats, record=now >= t_measure)
 
-async def run_benchmark(base_url: str, cluster_path: str, num_requests: int):
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    stats.elapsed = min(time.perf_counter(), t_end) - t_measure
+    return stats
+
+async def run_open(session, url: str, rate: float, duration: float, warmup: float) -> RunStats:
+    # constant arrival rate: request i is due at t_start + i / rate, whether or not
+    # earlier requests have finished
+    stats = RunStats()
+    t_start = time.perf_counter()
+    t_measure = t_start + warmup
+    t_end = t_measure + duration
+    tasks = []
+    i = 0
+    while True:
+        due = t_start + i / rate
+        if due >= t_end:
+            break
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(call_endpoint(session, url, stats, start=due, record=due >= t_measure)))
+        i += 1
+    await asyncio.gather(*tasks)
+    stats.elapsed = duration
+    return stats
+
+async def run_shard(url: str, args) -> RunStats:
+    # one event loop, one session; limit=0 means unlimited connections
+    timeout = aiohttp.ClientTimeout(total=args.timeout)
+    connector = aiohttp.TCPConnector(
+        limit=args.connector_limit,
+        force_close=args.no_keepalive,
+        keepalive_timeout=None if args.no_keepalive else args.keepalive_timeout,
+    )
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        if args.mode == "burst":
+            return await run_burst(session, url, args.requests)
+        elif args.mode == "closed":
+            return await run_closed(session, url, args.concurrency, args.duration, args.warmup)
+        else:
+            return await run_open(session, url, args.rate, args.duration, args.warmup)
+
+def shard_main(url: str, args) -> dict:
+    # entry point of a worker process
+    return asyncio.run(run_shard(url, args)).to_dict()
+
+def split_args(args, n: int) -> list:
+    # divide the load evenly between n worker processes; the remainder goes to the first
+    # shards, so the totals are exactly what was asked for (n <= concurrency, see parse_args)
+    shards = []
+    for i in range(n):
+        a = copy.copy(args)
+        a.requests = args.requests // n + (1 if i < args.requests % n else 0)
+        a.concurrency = args.concurrency // n + (1 if i < args.concurrency % n else 0)
+        a.rate = args.rate / n
+        shards.append(a)
+    return shards
+
+async def run_benchmark(base_url: str, cluster_path: str, args) -> RunStats:
     url = f"{base_url}{cluster_path}"
-    print(f"\n--- Benchmarking {cluster_path} with {num_requests} requests ---")
+    if args.mode == "burst":
+        what = f"{args.requests} requests at once"
+    elif args.mode == "closed":
+        what = f"{args.concurrency} concurrent clients for {args.duration:g}s (+{args.warmup:g}s warmup)"
+    else:
+        what = f"{args.rate:g} req/s open loop for {args.duration:g}s (+{args.warmup:g}s warmup)"
+    conns = "unlimited" if args.connector_limit == 0 else args.connector_limit
+    print(f"\n--- Benchmarking {cluster_path}: {what} ---")
     print(f"Target URL: {url}")
-    
-    start_time = time.time()
-    
-    async with aiohttp.ClientSession() as session:
-        tasks = [call_endpoint(session, url, i) for i in range(num_requests)]
-        results = await asyncio.gather(*tasks)
-        
-    end_time = time.time()
-    
-    total_time = end_time - start_time
-    successful_requests = sum(1 for r in results if r)
-    failed_requests = num_requests - successful_requests
-    avg_time_per_request = total_time / num_requests
-    requests_per_second = successful_requests / total_time if total_time > 0 else 0
-    
+    print(f"Processes: {args.processes}, connections/process: {conns}, "
+          f"keep-alive: {'off' if args.no_keepalive else 'on'}")
+
+    if args.processes <= 1:
+        stats = await run_shard(url, args)
+    else:
+        # a single event loop saturates its own core before the LB; shard the load
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=args.processes, mp_context=ctx) as pool:
+            shards = split_args(args, args.processes)
+            results = list(pool.map(shard_main, [url] * len(shards), shards))
+        stats = RunStats()
+        for r in results:
+            stats.merge(RunStats.from_dict(r))
+    print_report(stats)
+    return stats
+
+def print_report(stats: RunStats):
+    h = stats.hist
+    failed = sum(stats.errors.values())
+    total_time = stats.elapsed
+    requests_per_second = stats.ok / total_time if total_time > 0 else 0
+
     print("\n--- Results ---")
-    print(f"Total time taken:      {total_time:.2f} seconds")
-    print(f"Successful requests:   {successful_requests}/{num_requests}")
-    print(f"Failed requests:       {failed_requests}")
+    print(f"Measured time:         {total_time:.2f} seconds")
+    print(f"Successful requests:   {stats.ok}/{h.n}")
+    print(f"Failed requests:       {failed}")
     print(f"Requests per second:   {requests_per_second:.2f} RPS")
-    print(f"Avg. time per request: {avg_time_per_request * 1000:.2f} ms")
+    print("Latency (ms):")
+    print(f"  mean {h.mean():8.2f}   p50 {h.percentile(50):8.2f}   p90 {h.percentile(90):8.2f}")
+    print(f"  p99  {h.percentile(99):8.2f}   p99.9 {h.percentile(99.9):6.2f}   max {h.max_us / 1000:8.2f}")
+    if stats.server.n:
+        # processing time inside the app; the rest of the latency is LB, network and queueing
+        sv = stats.server
+        print("Server time (ms, X-Server-Time-Ms):")
+        print(f"  mean {sv.mean():8.2f}   p50 {sv.percentile(50):8.2f}   p99 {sv.percentile(99):8.2f}")
+    if stats.errors:
+        print("Errors:")
+        for kind, count in stats.errors.most_common():
+            print(f"  {kind:<22} {count:>6}")
+    print_distribution(stats.per_instance)
     print("-----------------")
 
+def print_distribution(per_instance: Counter):
+    # How the LB strategy spread the load across the cluster's instances
+    total = sum(per_instance.values())
+    if not total:
+        return
+    print("Per-instance distribution:")
+    for instance_id, count in per_instance.most_common():
+        print(f"  {instance_id:<22} {count:>6}  {100.0 * count / total:5.1f}%")
+
+def git_rev() -> str:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True)
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"],
+                               capture_output=True, text=True).stdout.strip()
+        return out.stdout.strip() + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+def get_json(url: str) -> dict | None:
+    try:
+        with urllib.request.urlopen(url, timeout=5) as r:
+            return json.load(r)
+    except (OSError, ValueError):
+        return None
+
+def lb_info(base_url: str) -> tuple[dict, dict]:
+    # (config, per-cluster strategies) as reported by the LB; this machine's env for an older LB
+    config = get_json(f"{base_url}/status/config")
+    if config is None:
+        config = {k: os.environ[k] for k in ("LB_PROBE_INTERVAL", "LB_EWMA_ALPHA", "LB_TIMEOUT", "LB_STRATEGY")
+                  if k in os.environ}
+    clusters = get_json(f"{base_url}/status/clusters") or {}
+    return config, {name: c.get("strategy") for name, c in clusters.items()}
+
+def make_record(stats: RunStats, path: str, args, config: dict, strategies: dict) -> dict:
+    cluster = path.split("?")[0].strip("/")
+    h = stats.hist
+    return {
+        "time": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "git_rev": git_rev(),
+        "label": args.label,
+        "base_url": args.base_url,
+        "path": path,
+        "cluster": cluster,
+        "strategy": args.strategy or strategies.get(cluster) or config.get("LB_STRATEGY"),
+        "config": config,
+        "args": {k: getattr(args, k) for k in ("mode", "requests", "concurrency", "rate", "duration", "warmup",
+                                               "timeout", "processes", "connector_limit", "no_keepalive")},
+        "summary": {"ok": stats.ok, "failed": sum(stats.errors.values()), "elapsed": stats.elapsed,
+                    "rps": stats.ok / stats.elapsed if stats.elapsed > 0 else 0.0,
+                    "p50_ms": h.percentile(50), "p99_ms": h.percentile(99), "max_ms": h.max_us / 1000.0},
+        "throughput": stats.throughput(),
+        "stats": stats.to_dict(),
+    }
+
+def save_record(record: dict, results_dir: str) -> pathlib.Path:
+    stamp = record["time"].replace(":", "").replace("-", "").replace("+0000", "Z")
+    name = "-".join(filter(None, [stamp, record["git_rev"], record["strategy"], record["label"], record["cluster"]]))
+    name = "".join(c if c.isalnum() or c in "-_.=" else "_" for c in name)
+    path = pathlib.Path(results_dir) / f"{name}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(record, indent=1))
+    return path
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(
+        description="Benchmark the load balancer cluster endpoints.",
+        epilog="Example: python benchmark.py http://98.87.148.211 --mode open --rate 500 --duration 30",
+    )
+    p.add_argument("base_url", help="Load balancer base URL, e.g. http://98.87.148.211")
+    p.add_argument("--mode", choices=["burst", "closed", "open"], default="burst",
+                   help="burst: N requests at once; closed: fixed concurrency; open: constant arrival rate")
+    p.add_argument("--requests", type=int, default=1000, help="burst: number of requests")
+    p.add_argument("--concurrency", type=int, default=50, help="closed: concurrent clients")
+    p.add_argument("--rate", type=float, default=200.0, help="open: requests per second")
+    p.add_argument("--duration", type=float, default=30.0, help="closed/open: measured seconds")
+    p.add_argument("--warmup", type=float, default=5.0, help="closed/open: unmeasured seconds before")
+    p.add_argument("--timeout", type=float, default=10.0, help="per-request timeout, seconds")
+    p.add_argument("--paths", default="/cluster1,/cluster2", help="comma-separated paths to benchmark")
+    p.add_argument("--processes", type=int, default=1, help="worker processes, each with its own event loop")
+    p.add_argument("--connector-limit", type=int, default=100, help="max connections per process (0 = unlimited)")
+    p.add_argument("--no-keepalive", action="store_true", help="close the connection after every request")
+    p.add_argument("--keepalive-timeout", type=float, default=15.0, help="idle keep-alive seconds")
+    p.add_argument("--results-dir", default="artifacts/benchmarks", help="where each run's JSON record is saved")
+    p.add_argument("--no-save", action="store_true", help="only print the results")
+    p.add_argument("--label", default="", help="free-form tag stored with the record and in its file name")
+    p.add_argument("--strategy", default="", help="strategy to record (default: as reported by the LB)")
+    args = p.parse_args(argv)
+    if args.processes < 1 or args.concurrency < 1 or args.requests < 1:
+        p.error("--processes, --concurrency and --requests must be at least 1")
+    # every process needs at least one client (closed) or request (burst) of its own
+    units = {"closed": args.concurrency, "burst": args.requests}.get(args.mode)
+    if units is not None and args.processes > units:
+        print(f"Note: only {units} {'clients' if args.mode == 'closed' else 'requests'}; "
+              f"using {units} processes instead of {args.processes}")
+        args.processes = units
+    return args
+
 async def main():
-    if len(sys.argv) < 2:
-        print("Usage: python benchmark.py <load_balancer_base_url>")
-        print("Example: python benchmark.py http://98.87.148.211")
-        sys.exit(1)
-        
-    base_url = sys.argv[1]
-    num_requests = 1000
-    
-    await run_benchmark(base_url, "/cluster1", num_requests)
-    await run_benchmark(base_url, "/cluster2", num_requests)
+    args = parse_args(sys.argv[1:])
+    config, strategies = lb_info(args.base_url) if not args.no_save else ({}, {})
+    for path in args.paths.split(","):
+        stats = await run_benchmark(args.base_url, path, args)
+        if not args.no_save:
+            saved = save_record(make_record(stats, path, args, config, strategies), args.results_dir)
+            print(f"Saved {saved}")
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,5 +1,14 @@
 #!/usr/bin/env python3
-import json, os, sys, subprocess, pathlib, base64
+# Deploys app/ to every instance in artifacts/instances.json, --parallel hosts at a time.
+# Each host gets one multiplexed SSH connection (ControlMaster) that all its steps reuse;
+# output is streamed with a [host] prefix and a table of step timings is printed at the end.
+# A failing host doesn't stop the others; the exit code is 1 if any host failed.
+import argparse, json, os, sys, subprocess, pathlib, base64, shutil, tempfile, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+import wheelhouse
 
 KEY_PATH = os.getenv("AWS_KEY_PATH")
 if not KEY_PATH:
@@ -7,6 +16,19 @@ if not KEY_PATH:
 
 APP_SRC = pathlib.Path("app").resolve()
 SSH_USER = "ubuntu"
+# share of per-request app log lines kept (uvicorn access logs are off in the unit)
+LOG_SAMPLE = os.getenv("APP_LOG_SAMPLE", "0.01")
+# uvicorn workers per instance; empty = one per vCPU of the instance
+WORKERS = os.getenv("APP_WORKERS", "")
+PARALLEL = int(os.getenv("DEPLOY_PARALLEL", "8"))
+
+# one master connection per host, kept open for the whole rollout; %C is a hash of host/user/port
+CONTROL_DIR = tempfile.mkdtemp(prefix="deploy-ssh-")
+MUX_OPTS = [
+    "-o", "ControlMaster=auto",
+    "-o", f"ControlPath={CONTROL_DIR}/%C",
+    "-o", "ControlPersist=120",
+]
 
 SSH_BASE = [
     "ssh",
@@ -16,24 +38,47 @@ SSH_BASE = [
     "-o", "ServerAliveCountMax=3",
     "-o", "ConnectTimeout=20",
     "-o", "ConnectionAttempts=10",
-]
-
-def ssh(host, cmd):
+] + MUX_OPTS
+
+print_lock = threading.Lock()
+
+def log(host: str, line: str):
+    with print_lock:
+        print(f"[{host}] {line}", flush=True)
+
+class StepFailed(Exception):
+    def __init__(self, host: str, step: str, output: str):
+        super().__init__(f"[{host}] Failed: {step}")
+        self.step = step
+        self.output = output
+
+def stream(host: str, step: str, args: list[str]) -> str:
+    # run a local command, echo its output line by line with the host prefix, return the output
+    proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1)
+    lines = []
+    assert proc.stdout is not None
+    for line in proc.stdout:
+        line = line.rstrip("\n")
+        lines.append(line)
+        log(host, "  " + line)
+    output = "\n".join(lines)
+    if proc.wait() != 0:
+        raise StepFailed(host, step, output)
+    return output
+
+def ssh(host, cmd, step: str | None = None) -> str:
     remote = f"bash -lc '{cmd}'"
-    return subprocess.run(
-        SSH_BASE + ["-i", KEY_PATH, f"{SSH_USER}@{host}", remote],
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
-    )
+    log(host, f"$ {step or cmd}")
+    return stream(host, step or cmd, SSH_BASE + ["-i", KEY_PATH, f"{SSH_USER}@{host}", remote])
 
 def scp_dir(host, local_path, remote_home="~"):
-    return subprocess.run(
-        ["scp", "-o", "StrictHostKeyChecking=no", "-i", KEY_PATH, "-r",
-         local_path, f"{SSH_USER}@{host}:{remote_home}"],
-        stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True
-    )
+    log(host, f"$ scp {local_path}")
+    return stream(host, "scp", ["scp", "-o", "StrictHostKeyChecking=no", *MUX_OPTS, "-i", KEY_PATH, "-r",
+                                local_path, f"{SSH_USER}@{host}:{remote_home}"])
 
-with open("artifacts/instances.json") as f:
-    instances = json.load(f)
+def close_master(host):
+    subprocess.run(SSH_BASE + ["-i", KEY_PATH, "-O", "exit", f"{SSH_USER}@{host}"],
+                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
 
 SERVICE_PATH = "/etc/systemd/system/fastapi.service"
 
@@ -45,8 +90,9 @@ After=network.target
 User=ubuntu
 WorkingDirectory=/home/ubuntu/app
 Environment=CLUSTER_NAME={cluster}
+Environment=APP_LOG_SAMPLE={log_sample}
 ExecStartPre=/bin/bash -lc 'fuser -k 8000/tcp || true'
-ExecStart=/usr/bin/python3 -m uvicorn main:app --host 0.0.0.0 --port 8000
+ExecStart=/usr/bin/python3 -m uvicorn main:app --host 0.0.0.0 --port 8000 --workers {workers} --no-access-log
 Restart=always
 RestartSec=2
 TimeoutStartSec=30
@@ -55,79 +101,118 @@ TimeoutStartSec=30
 WantedBy=multi-user.target
 """
 
-
-def deploy_one(host: str, cluster: str):
-    print(f"\nDeploying to {host} ({cluster}) as {SSH_USER}")
-
-    apt_prep = "sudo rm -f /etc/apt/apt.conf.d/50command-not-found || true"
-    fix_lists = "sudo rm -rf /var/lib/apt/lists/* && sudo mkdir -p /var/lib/apt/lists/partial && sudo apt-get clean"
-    apt_update = (
-        f"{apt_prep}; "
-        "sudo apt-get update -y "
-        "|| (" + fix_lists + " && sudo apt-get update -y) "
-        "|| true"
-    )
-
-    setup_cmds = [
-        apt_update,
-        "sudo DEBIAN_FRONTEND=noninteractive apt-get install -y --no-install-recommends python3 python3-pip curl "
-        "|| (" + fix_lists + " && sudo apt-get update -y && "
-        "sudo DEBIAN_FRONTEND=noninteractive apt-get install -y --no-install-recommends python3 python3-pip curl)",
-        "mkdir -p ~/app && rm -rf ~/app/*",
-    ]
-    for c in setup_cmds:
-        print(f"[{host}] $ {c}")
-        r = ssh(host, c)
-        if r.returncode != 0:
-            print(r.stdout); sys.exit(f"[{host}] Failed: {c}")
-
-    print(f"[{host}] Copying app/ …")
-    r = scp_dir(host, str(APP_SRC))
-    if r.returncode != 0:
-        print(r.stdout); sys.exit(f"[{host}] SCP failed")
-
-    for c in [
-        "python3 -m pip install --upgrade pip",
-        "python3 -m pip install fastapi 'uvicorn[standard]'",
-    ]:
-        print(f"[{host}] $ {c}")
-        r = ssh(host, c)
-        if r.returncode != 0:
-            print(r.stdout); sys.exit(f"[{host}] Failed: {c}")
-
-    unit_text = SERVICE_TPL.format(cluster=cluster)
-    unit_b64  = base64.b64encode(unit_text.encode("utf-8")).decode("ascii")
-
-    write_unit = (
-        f"echo '{unit_b64}' | base64 -d | sudo tee {SERVICE_PATH} >/dev/null && "
-        "sudo systemctl daemon-reload && "
-        "sudo systemctl enable --now fastapi && "
-        "sudo systemctl restart fastapi || true"
-    )
-    print(f"[{host}] $ install systemd unit")
-    r = ssh(host, write_unit)
-    if r.returncode != 0:
-        print(r.stdout); sys.exit(f"[{host}] Failed to install/start systemd unit")
-
-    ready_cmd = (
-        f"for i in $(seq 1 60); do "
-        f"  code=$(curl -s -o /dev/null -w %{{http_code}} http://127.0.0.1:8000/{cluster}); "
-        f"  [ \"$code\" = 200 ] && echo READY && exit 0; "
-        f"  sleep 1; "
-        f"done; echo NOT_READY;"
-        f"sudo systemctl --no-pager --full status fastapi || true; "
-        f"journalctl -u fastapi -n 120 --no-pager || true; exit 1"
-    )
-    print(f"[{host}] Waiting for app to become ready …")
-    r = ssh(host, ready_cmd)
-    print(r.stdout, end="")
-    if r.returncode != 0:
-        sys.exit(f"[{host}] App did not become ready")
-
-for inst in instances:
-    ip = inst.get("public_ip")
-    cluster = inst.get("cluster", "")
-    if ip and cluster:
-        deploy_one(ip, cluster)
-
-print("✅ Deployment complete!")
+@dataclass
+class HostResult:
+    host: str
+    cluster: str
+    steps: dict[str, float] = field(default_factory=dict)   # step -> seconds
+    error: str | None = None
+
+    @property
+    def total(self) -> float:
+        return sum(self.steps.values())
+
+@contextmanager
+def timed(result: HostResult, name: str):
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        result.steps[name] = time.perf_counter() - t0
+
+def upload_wheelhouse(host: str, wh: wheelhouse.Wheelhouse):
+    # only when this exact wheelhouse isn't on the host yet
+    if "MISSING" not in ssh(host, wh.check_cmd(), f"check wheelhouse {wh.digest}"):
+        log(host, "wheelhouse already present")
+        return
+    scp_dir(host, str(wh.tarball))
+    ssh(host, wh.unpack_cmd(f"~/{wh.tarball.name}"), "unpack wheelhouse")
+
+def deploy_one(host: str, cluster: str, wh: wheelhouse.Wheelhouse) -> HostResult:
+    result = HostResult(host, cluster)
+    log(host, f"Deploying ({cluster}) as {SSH_USER}")
+    try:
+        with timed(result, "wheels"):
+            upload_wheelhouse(host, wh)
+
+        with timed(result, "copy"):
+            ssh(host, "mkdir -p ~/app && rm -rf ~/app/*")
+            scp_dir(host, str(APP_SRC))
+
+        with timed(result, "pip"):
+            ssh(host, wh.install_cmd(), "pip install from wheelhouse (offline)")
+
+        with timed(result, "unit"):
+            workers = WORKERS
+            if not workers:
+                out = ssh(host, "nproc").split()
+                workers = out[-1] if out and out[-1].isdigit() else "1"
+            log(host, f"uvicorn workers: {workers}")
+            unit_text = SERVICE_TPL.format(cluster=cluster, log_sample=LOG_SAMPLE, workers=workers)
+            unit_b64 = base64.b64encode(unit_text.encode("utf-8")).decode("ascii")
+            write_unit = (
+                f"echo '{unit_b64}' | base64 -d | sudo tee {SERVICE_PATH} >/dev/null && "
+                "sudo systemctl daemon-reload && "
+                "sudo systemctl enable --now fastapi && "
+                "sudo systemctl restart fastapi || true"
+            )
+            ssh(host, write_unit, "install systemd unit")
+
+        with timed(result, "ready"):
+            ready_cmd = (
+                f"for i in $(seq 1 60); do "
+                f"  code=$(curl -s -o /dev/null -w %{{http_code}} http://127.0.0.1:8000/{cluster}); "
+                f"  [ \"$code\" = 200 ] && echo READY && exit 0; "
+                f"  sleep 1; "
+                f"done; echo NOT_READY;"
+                f"sudo systemctl --no-pager --full status fastapi || true; "
+                f"journalctl -u fastapi -n 120 --no-pager || true; exit 1"
+            )
+            ssh(host, ready_cmd, "wait for app to become ready")
+    except StepFailed as e:
+        result.error = e.step
+        log(host, f"FAILED: {e.step}")
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+        log(host, f"FAILED: {result.error}")
+    finally:
+        close_master(host)
+    return result
+
+def print_summary(results: list[HostResult], wall: float):
+    names: list[str] = []
+    for r in results:
+        names += [n for n in r.steps if n not in names]
+    print(f"\n{'host':<16} {'cluster':<9}" + "".join(f"{n:>8}" for n in names) + f"{'total':>9}  status")
+    for r in results:
+        cells = "".join(f"{r.steps[n]:>7.1f}s" if n in r.steps else f"{'-':>8}" for n in names)
+        status = "ok" if r.error is None else f"FAILED ({r.error})"
+        print(f"{r.host:<16} {r.cluster:<9}{cells}{r.total:>8.1f}s  {status}")
+    print(f"Wall time: {wall:.1f}s for {len(results)} hosts")
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description="Deploy app/ to the instances in artifacts/instances.json.")
+    p.add_argument("--parallel", type=int, default=PARALLEL, help="hosts deployed at the same time (1 = serial)")
+    return p.parse_args(argv)
+
+def main():
+    args = parse_args(sys.argv[1:])
+    with open("artifacts/instances.json") as f:
+        instances = json.load(f)
+    hosts = [(i["public_ip"], i["cluster"]) for i in instances if i.get("public_ip") and i.get("cluster")]
+    wh = wheelhouse.build()
+    print(f"Wheelhouse {wh.digest}: {wh.tarball}")
+    t0 = time.perf_counter()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, args.parallel)) as pool:
+            results = list(pool.map(lambda hc: deploy_one(*hc, wh), hosts))
+    finally:
+        shutil.rmtree(CONTROL_DIR, ignore_errors=True)
+    print_summary(results, time.perf_counter() - t0)
+    failed = [r for r in results if r.error is not None]
+    if failed:
+        sys.exit(f"❌ Deployment failed on {len(failed)}/{len(results)} hosts: {', '.join(r.host for r in failed)}")
+    print("✅ Deployment complete!")
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,12 @@
 #!/usr/bin/env python3
 import json, os, sys, subprocess, base64, time
 
+import wheelhouse
+
 KEY_PATH = os.getenv("AWS_KEY_PATH")
 if not KEY_PATH:
     sys.exit("Missing AWS_KEY_PATH")
+LB_WORKERS = int(os.getenv("LB_WORKERS", "2"))  # uvicorn workers; t2.large has 2 vCPUs
 
 SSH_OPTS = [
     "ssh", "-o", "StrictHostKeyChecking=no", "-o", "BatchMode=yes",
@@ -27,6 +30,9 @@ with open("artifacts/instances.json") as f:
 with open("artifacts/lb.json") as f:
     lb = json.load(f)
 
+# pinned wheels, downloaded locally once (see scripts/wheelhouse.py)
+WHEELS = wheelhouse.build()
+
 print("Waiting 60 seconds for the new instance to initialize its SSH service...")
 time.sleep(60)
 HOST = lb["public_ip"]
@@ -41,9 +47,11 @@ try:
     print(f"[{HOST}] Waiting for cloud-init to finish (max 2 mins)...")
     ssh(HOST, "sudo cloud-init status --wait")
 
-    print(f"[{HOST}] Installing Python dependencies...")
-    ssh(HOST, "sudo apt-get update -y && sudo DEBIAN_FRONTEND=noninteractive apt-get install -y --no-install-recommends python3-pip")
-    ssh(HOST, "python3 -m pip install --upgrade pip fastapi uvicorn httpx")
+    print(f"[{HOST}] Installing Python dependencies from wheelhouse {WHEELS.digest} (offline)...")
+    if "MISSING" in ssh(HOST, WHEELS.check_cmd()).stdout:
+        scp_path(HOST, str(WHEELS.tarball))
+        ssh(HOST, WHEELS.unpack_cmd(f"~/{WHEELS.tarball.name}"))
+    ssh(HOST, WHEELS.install_cmd())
 
     print(f"[{HOST}] Copying lb/ source code...")
     scp_path(HOST, "lb")
@@ -63,16 +71,22 @@ After=network.target
 User=ubuntu
 WorkingDirectory=/home/ubuntu/lb
 Environment=LB_CONFIG=/etc/lb/targets.json
+Environment=LB_SHM_PATH={shm_path}
 AmbientCapabilities=CAP_NET_BIND_SERVICE
 CapabilityBoundingSet=CAP_NET_BIND_SERVICE
-ExecStart=/usr/bin/python3 -m uvicorn lb:app --host 0.0.0.0 --port 80
+ExecStart=/usr/bin/python3 -m uvicorn lb:app --host 0.0.0.0 --port 80 --workers {workers}
 Restart=always
 RestartSec=2
 
 [Install]
 WantedBy=multi-user.target
 """
-    unit_b64 = base64.b64encode(SERVICE_TPL.encode("utf-8")).decode("ascii")
+    # with several workers, one prober publishes target state to the others via /dev/shm
+    unit_text = SERVICE_TPL.format(
+        workers=LB_WORKERS,
+        shm_path="/dev/shm/lb-state" if LB_WORKERS > 1 else "",
+    )
+    unit_b64 = base64.b64encode(unit_text.encode("utf-8")).decode("ascii")
     ssh(
         HOST,
         f"echo '{unit_b64}' | base64 -d | sudo tee /etc/systemd/system/lb.service >/dev/null && "
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+# Local stand-in for the EC2 deployment: N copies of app/main.py on loopback ports,
+# split into cluster1/cluster2, plus lb/lb.py in front of them, then the benchmark.
+# Needs fastapi, uvicorn, httpx and aiohttp in the current Python environment.
+import argparse, json, os, pathlib, shlex, signal, subprocess, sys, tempfile, time, urllib.request
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+PY = sys.executable
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description="Run app instances + LB + benchmark on localhost.")
+    p.add_argument("--large", type=int, default=4, help="cluster1 instances")
+    p.add_argument("--micro", type=int, default=4, help="cluster2 instances")
+    p.add_argument("--base-port", type=int, default=9001, help="first app instance port")
+    p.add_argument("--lb-port", type=int, default=8080)
+    # injected behaviour per cluster: base latency (ms), +/- uniform jitter (ms), failure rate
+    p.add_argument("--delay1", type=float, default=2.0)
+    p.add_argument("--jitter1", type=float, default=1.0)
+    p.add_argument("--fail1", type=float, default=0.0)
+    p.add_argument("--delay2", type=float, default=8.0)
+    p.add_argument("--jitter2", type=float, default=6.0)
+    p.add_argument("--fail2", type=float, default=0.01)
+    p.add_argument("--lb-env", action="append", default=[], metavar="KEY=VALUE",
+                   help="extra LB environment, repeatable (e.g. --lb-env LB_STRATEGY=p2c)")
+    p.add_argument("--strategies", default="",
+                   help="comma-separated LB strategies; restarts the LB and re-runs the benchmark for each")
+    p.add_argument("--variants", default="",
+                   help="semicolon-separated LB environments to compare, each a comma-separated KEY=VALUE list "
+                        "(e.g. 'LB_FAST_PATH=0;LB_FAST_PATH=1'); restarts the LB and re-runs the benchmark for each")
+    p.add_argument("--bench-args", default="--mode open --rate 300 --duration 20 --warmup 3",
+                   help="arguments passed to scripts/benchmark.py")
+    p.add_argument("--keep", action="store_true", help="don't benchmark; keep everything running until Ctrl-C")
+    return p.parse_args(argv)
+
+def spawn(args: list[str], env: dict, log: pathlib.Path) -> subprocess.Popen:
+    out = open(log, "w")
+    return subprocess.Popen(args, env={**os.environ, **env}, stdout=out, stderr=subprocess.STDOUT, cwd=ROOT)
+
+def uvicorn(app_dir: str, app: str, port: int) -> list[str]:
+    return [PY, "-m", "uvicorn", app, "--app-dir", str(ROOT / app_dir),
+            "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"]
+
+def wait_http(url: str, ok, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    last = None
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(url, timeout=2) as r:
+                body = r.read()
+                if ok(body):
+                    return
+        except Exception as e:
+            last = e
+        time.sleep(0.3)
+    sys.exit(f"Timed out waiting for {url} ({last})")
+
+def stop(procs: list[subprocess.Popen]):
+    for p in procs:
+        if p.poll() is None:
+            p.send_signal(signal.SIGINT)
+    for p in procs:
+        try:
+            p.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            p.kill()
+
+def start_apps(args, workdir: pathlib.Path) -> tuple[list[subprocess.Popen], dict]:
+    procs, targets = [], {"cluster1": [], "cluster2": []}
+    port = args.base_port
+    layout = [("cluster1", args.large, args.delay1, args.jitter1, args.fail1),
+              ("cluster2", args.micro, args.delay2, args.jitter2, args.fail2)]
+    for cluster, count, delay, jitter, fail in layout:
+        for i in range(count):
+            env = {
+                "CLUSTER_NAME": cluster,
+                "INSTANCE_ID": f"local-{cluster}-{i}",
+                "APP_DELAY_MS": str(delay),
+                "APP_JITTER_MS": str(jitter),
+                "APP_FAIL_RATE": str(fail),
+            }
+            procs.append(spawn(uvicorn("app", "main:app", port), env, workdir / f"app-{port}.log"))
+            targets[cluster].append(f"http://127.0.0.1:{port}/{cluster}")
+            port += 1
+    for urls in targets.values():
+        for url in urls:
+            wait_http(url, lambda body: True)
+    return procs, targets
+
+def parse_env(pairs: list[str]) -> dict:
+    env = {}
+    for kv in pairs:
+        k, _, v = kv.strip().partition("=")
+        env[k] = v
+    return env
+
+def label(extra: dict) -> str:
+    return ",".join(f"{k}={v}" for k, v in extra.items()) or "default"
+
+def start_lb(args, workdir: pathlib.Path, config: pathlib.Path, extra: dict) -> subprocess.Popen:
+    env = {"LB_CONFIG": str(config), **parse_env(args.lb_env), **extra}
+    tag = "".join(c if c.isalnum() or c in "=-_" else "_" for c in label(extra))
+    proc = spawn(uvicorn("lb", "lb:app", args.lb_port), env, workdir / f"lb-{tag}.log")
+
+    def all_probed(body: bytes) -> bool:
+        snap = json.loads(body)
+        return all(any(t["healthy"] for t in tgts) for tgts in snap.values())
+
+    wait_http(f"http://127.0.0.1:{args.lb_port}/status", all_probed)
+    return proc
+
+def run_bench(args, label: str):
+    cmd = [PY, str(ROOT / "scripts" / "benchmark.py"), f"http://127.0.0.1:{args.lb_port}",
+           *shlex.split(args.bench_args)]
+    print(f"\n===== {label}: {' '.join(cmd[1:])}", flush=True)
+    subprocess.run(cmd, cwd=ROOT, check=False)
+
+def main():
+    args = parse_args(sys.argv[1:])
+    workdir = pathlib.Path(tempfile.mkdtemp(prefix="lb-local-"))
+    print(f"Logs and targets.json in {workdir}")
+    procs: list[subprocess.Popen] = []
+    try:
+        apps, targets = start_apps(args, workdir)
+        procs += apps
+        config = workdir / "targets.json"
+        config.write_text(json.dumps(targets, indent=2))
+        print(f"Started {args.large} + {args.micro} app instances on ports {args.base_port}+")
+
+        runs = [{"LB_STRATEGY": s} for s in args.strategies.split(",") if s]
+        runs += [parse_env(v.split(",")) for v in args.variants.split(";") if v.strip()]
+        for extra in runs or [{}]:
+            lb = start_lb(args, workdir, config, extra)
+            procs.append(lb)
+            print(f"LB on http://127.0.0.1:{args.lb_port} ({label(extra)})")
+            if args.keep:
+                print("Press Ctrl-C to stop.")
+                while True:
+                    time.sleep(3600)
+            run_bench(args, label(extra))
+            stop([lb])
+            procs.remove(lb)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop(procs)
+
+if __name__ == "__main__":
+    main()
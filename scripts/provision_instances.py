@@ -1,5 +1,13 @@
 #!/usr/bin/env python3
-import json, os, sys, itertools
+# Launches the application instances: 4 x t2.large (cluster1) and 4 x t2.micro (cluster2).
+# One run_instances call per (cluster, subnet) with MinCount=MaxCount=k, issued concurrently,
+# then a single instance_running waiter and one describe for all of them. artifacts/instances.json
+# is rewritten after every step, and a re-run only launches what is still missing: instances
+# from the file or tagged Cluster=cluster1/cluster2 that are pending or running are kept.
+# --serial launches and waits one instance at a time (the old behaviour), for comparison.
+import argparse, json, os, sys, time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from collections import Counter
 import boto3
 
 REGION   = os.getenv("AWS_REGION", "us-east-1")
@@ -8,78 +16,187 @@ SG_ID    = os.getenv("AWS_INSTANCE_SG_ID")
 AMI_ID   = os.getenv("AWS_AMI_ID", "")
 SUBNETS  = os.getenv("AWS_SUBNET_IDS", "").split(",") if os.getenv("AWS_SUBNET_IDS") else []
 
-if not (KEY_NAME and SG_ID and SUBNETS and len(SUBNETS) >= 2):
-    sys.exit("Missing one of: AWS_KEY_NAME, AWS_INSTANCE_SG_ID, AWS_SUBNET_IDS(2+)")
+ARTIFACT = "artifacts/instances.json"
+LAYOUT = [("cluster1", "t2.large", 4), ("cluster2", "t2.micro", 4)]   # cluster, type, count
+ALIVE = ["pending", "running"]
 
-ec2 = boto3.resource("ec2", region_name=REGION)
-ssm = boto3.client("ssm", region_name=REGION)
-
-if not AMI_ID:
+def resolve_ami(ssm) -> str:
     print("AMI_ID not found in environment, resolving from AWS SSM...")
     try:
-        AMI_ID = ssm.get_parameter(
+        ami = ssm.get_parameter(
             Name="/aws/service/canonical/ubuntu/server/22.04/stable/current/amd64/hvm/ebs-gp3/ami-id"
         )["Parameter"]["Value"]
     except Exception:
-        AMI_ID = ssm.get_parameter(
+        ami = ssm.get_parameter(
             Name="/aws/service/canonical/ubuntu/server/22.04/stable/current/amd64/hvm/ebs-gp2/ami-id"
         )["Parameter"]["Value"]
-    print(f"Using Ubuntu 22.04 AMI: {AMI_ID}")
-
-def create_group(instance_type: str, count: int, cluster_tag: str):
-    subnet_cycle = itertools.cycle(SUBNETS)
-    instances = []
-    print(f"Creating {count} x {instance_type} instance(s) for {cluster_tag}...")
-    for _ in range(count):
-        subnet = next(subnet_cycle)
-        instance_group = ec2.create_instances(
-            ImageId=AMI_ID,
-            InstanceType=instance_type,
-            MinCount=1, MaxCount=1,
-            KeyName=KEY_NAME,
-            NetworkInterfaces=[{
-                "DeviceIndex": 0,
-                "SubnetId": subnet,
-                "AssociatePublicIpAddress": True,
-                "Groups": [SG_ID],
-            }],
-            TagSpecifications=[{
-                "ResourceType": "instance",
-                "Tags": [
-                    {"Key": "Name", "Value": f"lab-{cluster_tag}-{instance_type}"},
-                    {"Key": "Cluster", "Value": cluster_tag},
-                ],
-            }],
-        )
-        instances.extend(instance_group)
-    return instances
-
-print("Creating 4 x t2.large (cluster1) and 4 x t2.micro (cluster2)...")
-grp_large = create_group("t2.large", 4, "cluster1")
-grp_micro = create_group("t2.micro", 4, "cluster2")
-all_instances = grp_large + grp_micro
-
-print("\nWaiting for all instances to enter the 'running' state...")
-for i in all_instances:
-    print(f"  ⏱  Waiting for {i.id} ({i.instance_type})...")
-    i.wait_until_running()
-    i.load() # Refresh instance attributes like public_ip_address
-
-print("\n✅ All instances are running. Details:")
-output_data = []
-for i in all_instances:
-    cluster_tag = next((tag['Value'] for tag in (i.tags or []) if tag.get("Key") == "Cluster"), "unknown")
-    print(f"  - {i.id} | {i.instance_type} | {cluster_tag} | {i.public_ip_address}")
-    output_data.append({
-        "id": i.id,
-        "type": i.instance_type,
-        "state": i.state["Name"],
-        "public_ip": i.public_ip_address,
-        "private_ip": i.private_ip_address,
-        "cluster": cluster_tag,
-    })
-
-os.makedirs("artifacts", exist_ok=True)
-with open("artifacts/instances.json", "w") as f:
-    json.dump(output_data, f, indent=2)
-print("\n✅ Wrote instance details to artifacts/instances.json.")
+    print(f"Using Ubuntu 22.04 AMI: {ami}")
+    return ami
+
+def record(i: dict) -> dict:
+    # one artifacts/instances.json entry from a describe_instances / run_instances item
+    tags = {t["Key"]: t["Value"] for t in i.get("Tags", [])}
+    return {
+        "id": i["InstanceId"],
+        "type": i["InstanceType"],
+        "state": i["State"]["Name"],
+        "public_ip": i.get("PublicIpAddress"),
+        "private_ip": i.get("PrivateIpAddress"),
+        "cluster": tags.get("Cluster", "unknown"),
+        "subnet": i.get("SubnetId"),
+    }
+
+def save(records: dict[str, dict], path: str = ARTIFACT):
+    # atomic rewrite, so an interrupted run leaves the previous or the new file, never half of one
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(list(records.values()), f, indent=2)
+    os.replace(tmp, path)
+
+def describe(ec2, ids: list[str]) -> list[dict]:
+    out = []
+    for page in ec2.get_paginator("describe_instances").paginate(InstanceIds=ids):
+        for r in page["Reservations"]:
+            out.extend(r["Instances"])
+    return out
+
+def existing(ec2, path: str = ARTIFACT) -> dict[str, dict]:
+    # instances from a previous (possibly interrupted) run that are still alive: the ones in
+    # the artifact file plus any tagged with one of our clusters that never made it into it
+    ids = []
+    if os.path.exists(path):
+        with open(path) as f:
+            ids = [r["id"] for r in json.load(f)]
+    filters = [{"Name": "instance-state-name", "Values": ALIVE},
+               {"Name": "tag:Cluster", "Values": [c for c, _, _ in LAYOUT]}]
+    found = []
+    for page in ec2.get_paginator("describe_instances").paginate(Filters=filters):
+        for r in page["Reservations"]:
+            found.extend(r["Instances"])
+    known = {i["InstanceId"] for i in found}
+    missing = [i for i in ids if i not in known]
+    if missing:
+        # ids from the file that the tag filter didn't return (e.g. untagged); look them up directly
+        try:
+            found += [i for i in describe(ec2, missing) if i["State"]["Name"] in ALIVE]
+        except ec2.exceptions.ClientError:
+            pass
+    return {i["InstanceId"]: record(i) for i in found}
+
+def plan(have: dict[str, dict], subnets: list[str]) -> list[tuple[str, str, str, int]]:
+    # (cluster, type, subnet, count) launches still needed, spread evenly over the subnets
+    launches = []
+    for cluster, itype, count in LAYOUT:
+        mine = [r for r in have.values() if r["cluster"] == cluster]
+        per_subnet = Counter(r.get("subnet") for r in mine)
+        todo = Counter()
+        for _ in range(max(0, count - len(mine))):
+            subnet = min(subnets, key=lambda s: per_subnet[s] + todo[s])
+            todo[subnet] += 1
+        launches += [(cluster, itype, s, k) for s, k in todo.items() if k]
+    return launches
+
+def launch_spec(ami: str, itype: str, subnet: str, cluster: str) -> dict:
+    return dict(
+        ImageId=ami,
+        InstanceType=itype,
+        KeyName=KEY_NAME,
+        NetworkInterfaces=[{
+            "DeviceIndex": 0,
+            "SubnetId": subnet,
+            "AssociatePublicIpAddress": True,
+            "Groups": [SG_ID],
+        }],
+        TagSpecifications=[{
+            "ResourceType": "instance",
+            "Tags": [
+                {"Key": "Name", "Value": f"lab-{cluster}-{itype}"},
+                {"Key": "Cluster", "Value": cluster},
+            ],
+        }],
+    )
+
+def provision_batched(ec2, ami: str, have: dict[str, dict], path: str = ARTIFACT) -> dict[str, dict]:
+    launches = plan(have, SUBNETS)
+    for cluster, itype, subnet, k in launches:
+        print(f"Launching {k} x {itype} for {cluster} in {subnet}...")
+
+    def run(launch):
+        cluster, itype, subnet, k = launch
+        return ec2.run_instances(MinCount=k, MaxCount=k, **launch_spec(ami, itype, subnet, cluster))
+
+    records = dict(have)
+    error: Exception | None = None
+    with ThreadPoolExecutor(max_workers=max(1, len(launches))) as pool:
+        futures = [pool.submit(run, launch) for launch in launches]
+        for fut in as_completed(futures):
+            # every successful launch is saved, even when another one failed, so a
+            # re-run sees those instances instead of launching them a second time
+            try:
+                resp = fut.result()
+            except Exception as e:
+                error = error or e
+                continue
+            for i in resp["Instances"]:
+                records[i["InstanceId"]] = record(i)
+            save(records, path)   # launched ids are on disk before we wait on anything
+    if error is not None:
+        raise error
+
+    pending = [rid for rid, r in records.items() if r["state"] != "running" or not r["public_ip"]]
+    if pending:
+        print(f"\nWaiting for {len(pending)} instance(s) to enter the 'running' state...")
+        ec2.get_waiter("instance_running").wait(InstanceIds=pending, WaiterConfig={"Delay": 5, "MaxAttempts": 80})
+        for i in describe(ec2, pending):
+            records[i["InstanceId"]] = record(i)
+        save(records, path)
+    return records
+
+def provision_serial(ec2, ami: str, have: dict[str, dict], path: str = ARTIFACT) -> dict[str, dict]:
+    # one instance per call, each waited on in turn
+    records = dict(have)
+    for cluster, itype, subnet, k in plan(have, SUBNETS):
+        for _ in range(k):
+            print(f"Launching 1 x {itype} for {cluster} in {subnet}...")
+            i = ec2.run_instances(MinCount=1, MaxCount=1, **launch_spec(ami, itype, subnet, cluster))["Instances"][0]
+            records[i["InstanceId"]] = record(i)
+            save(records, path)
+    for rid in [rid for rid, r in records.items() if r["state"] != "running" or not r["public_ip"]]:
+        print(f"  ⏱  Waiting for {rid}...")
+        ec2.get_waiter("instance_running").wait(InstanceIds=[rid], WaiterConfig={"Delay": 5, "MaxAttempts": 80})
+        records[rid] = record(describe(ec2, [rid])[0])
+        save(records, path)
+    return records
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description="Launch the cluster1/cluster2 application instances.")
+    p.add_argument("--serial", action="store_true", help="one launch call and one wait per instance")
+    p.add_argument("--fresh", action="store_true", help="ignore instances from a previous run")
+    return p.parse_args(argv)
+
+def main(argv=None):
+    global AMI_ID
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    if not (KEY_NAME and SG_ID and SUBNETS and len(SUBNETS) >= 2):
+        sys.exit("Missing one of: AWS_KEY_NAME, AWS_INSTANCE_SG_ID, AWS_SUBNET_IDS(2+)")
+    ec2 = boto3.client("ec2", region_name=REGION)
+    if not AMI_ID:
+        AMI_ID = resolve_ami(boto3.client("ssm", region_name=REGION))
+
+    have = {} if args.fresh else existing(ec2)
+    if have:
+        print(f"Keeping {len(have)} instance(s) from a previous run: {', '.join(sorted(have))}")
+    print("Creating 4 x t2.large (cluster1) and 4 x t2.micro (cluster2)...")
+    t0 = time.perf_counter()
+    provision = provision_serial if args.serial else provision_batched
+    records = provision(ec2, AMI_ID, have)
+
+    print(f"\n✅ All instances are running ({time.perf_counter() - t0:.1f}s). Details:")
+    for r in records.values():
+        print(f"  - {r['id']} | {r['type']} | {r['cluster']} | {r['public_ip']}")
+    print(f"\n✅ Wrote instance details to {ARTIFACT}.")
+    return records
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+# Runs provision_instances.py against moto's in-process EC2 stand-in (no AWS account, no cost):
+# serial vs batched provisioning, and resuming after an interrupted run. Each EC2 API call is
+# delayed by --latency-ms to stand in for the round trip to the real endpoint, so the timings
+# mostly reflect how many calls each mode makes and how many of them overlap.
+# Needs: pip install 'moto[ec2]' boto3
+import argparse, os, pathlib, sys, tempfile, time
+
+os.environ.setdefault("AWS_ACCESS_KEY_ID", "testing")
+os.environ.setdefault("AWS_SECRET_ACCESS_KEY", "testing")
+os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+
+import boto3
+from moto import mock_aws
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent))
+
+def parse_args(argv):
+    p = argparse.ArgumentParser(description="Time provision_instances.py against a mocked EC2.")
+    p.add_argument("--latency-ms", type=float, default=100.0, help="added delay per EC2 API call")
+    return p.parse_args(argv)
+
+def setup(region: str) -> dict:
+    ec2 = boto3.client("ec2", region_name=region)
+    vpc = ec2.create_vpc(CidrBlock="10.0.0.0/16")["Vpc"]["VpcId"]
+    subnets = [ec2.create_subnet(VpcId=vpc, CidrBlock=f"10.0.{i}.0/24")["Subnet"]["SubnetId"] for i in range(2)]
+    sg = ec2.create_security_group(GroupName="lab-instances", Description="lab", VpcId=vpc)["GroupId"]
+    ec2.create_key_pair(KeyName="lab-key")
+    ami = ec2.describe_images(Owners=["amazon"])["Images"][0]["ImageId"]
+    return {"AWS_KEY_NAME": "lab-key", "AWS_INSTANCE_SG_ID": sg, "AWS_SUBNET_IDS": ",".join(subnets),
+            "AWS_AMI_ID": ami}
+
+def client(region: str, latency_ms: float, calls: list):
+    ec2 = boto3.client("ec2", region_name=region)
+
+    def delay(**kwargs):
+        calls.append(kwargs.get("event_name", ""))
+        time.sleep(latency_ms / 1000.0)
+    ec2.meta.events.register("before-call.ec2.*", delay)
+    return ec2
+
+def terminate_all(region: str):
+    ec2 = boto3.client("ec2", region_name=region)
+    ids = [i["InstanceId"] for r in ec2.describe_instances()["Reservations"] for i in r["Instances"]]
+    if ids:
+        ec2.terminate_instances(InstanceIds=ids)
+
+def main():
+    args = parse_args(sys.argv[1:])
+    region = os.environ["AWS_DEFAULT_REGION"]
+    with mock_aws(), tempfile.TemporaryDirectory() as tmp:
+        os.environ.update(setup(region))
+        import provision_instances as prov   # reads the environment set up above
+        path = os.path.join(tmp, "instances.json")
+
+        def timed(label: str, fn, have: dict) -> dict:
+            calls: list[str] = []
+            ec2 = client(region, args.latency_ms, calls)
+            t0 = time.perf_counter()
+            records = fn(ec2, prov.AMI_ID, have, path)
+            dt = time.perf_counter() - t0
+            running = sum(1 for r in records.values() if r["state"] == "running")
+            print(f"{label:<28} {dt:7.2f}s  {len(calls):>4} API calls  {running} running")
+            return records
+
+        print(f"EC2 API latency: {args.latency_ms:g} ms per call\n")
+        timed("serial (old behaviour)", prov.provision_serial, {})
+        terminate_all(region)
+        timed("batched", prov.provision_batched, {})
+        terminate_all(region)
+
+        # interrupted run: only cluster1 made it, then resume from the file and the tags
+        prov.LAYOUT, full = prov.LAYOUT[:1], prov.LAYOUT
+        timed("batched, cluster1 only", prov.provision_batched, {})
+        prov.LAYOUT = full
+        have = prov.existing(boto3.client("ec2", region_name=region), path)
+        records = timed(f"resume ({len(have)} kept)", prov.provision_batched, have)
+        per_cluster = {c: sum(1 for r in records.values() if r["cluster"] == c) for c, _, _ in full}
+        print(f"\nAfter resume: {per_cluster}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# Pinned wheelhouse shared by deploy_fastapi.py and deploy_lb.py.
+# build() downloads every wheel in node-requirements.txt (plus pip itself) for the instances'
+# platform into .wheelhouse/, once, and packs them into a tarball named by its content hash.
+# On a node, the tarball is only uploaded if ~/wheelhouse/<hash> isn't there yet, and the
+# packages are installed offline with pip run straight from its wheel, so neither apt nor PyPI
+# is touched and a redeploy with unchanged requirements skips both upload and install.
+import hashlib, os, pathlib, subprocess, sys, tarfile
+from dataclasses import dataclass
+
+ROOT = pathlib.Path(__file__).resolve().parent.parent
+REQUIREMENTS = ROOT / "scripts" / "node-requirements.txt"
+CACHE = ROOT / ".wheelhouse"
+PIP = "pip==26.2.1"
+# Ubuntu 22.04 on x86_64: CPython 3.10, glibc 2.35 (WHEELHOUSE_PYTHON for another AMI)
+PYTHON_VERSION = os.getenv("WHEELHOUSE_PYTHON", "3.10")
+ABI = "cp" + PYTHON_VERSION.replace(".", "")
+PLATFORMS = ["manylinux_2_28_x86_64", "manylinux_2_17_x86_64", "manylinux2014_x86_64",
+             "manylinux_2_5_x86_64", "manylinux1_x86_64"]
+REMOTE_DIR = "~/wheelhouse"
+INSTALLED_MARK = "~/.wheelhouse-installed"
+
+@dataclass
+class Wheelhouse:
+    digest: str                # sha256 of the wheels and requirements, first 16 hex digits
+    tarball: pathlib.Path
+    pip_wheel: str             # file name of the pip wheel inside the tarball
+
+    @property
+    def remote(self) -> str:
+        return f"{REMOTE_DIR}/{self.digest}"
+
+    def check_cmd(self) -> str:
+        # prints PRESENT or MISSING
+        return f"test -f {self.remote}/.complete && echo PRESENT || echo MISSING"
+
+    def unpack_cmd(self, uploaded: str) -> str:
+        return (f"mkdir -p {self.remote} && tar -xf {uploaded} -C {self.remote} && rm -f {uploaded} "
+                f"&& touch {self.remote}/.complete")
+
+    def install_cmd(self) -> str:
+        # no single quotes: the deploy scripts wrap commands in bash -lc '...'.
+        # --user into ~/.local; --break-system-packages only matters on PEP 668 distros (24.04+)
+        return (
+            f"if [ \"$(cat {INSTALLED_MARK} 2>/dev/null)\" = {self.digest} ]; then echo already installed; "
+            f"else python3 {self.remote}/{self.pip_wheel}/pip install --user --break-system-packages "
+            f"--no-index --no-warn-script-location --find-links {self.remote} -r {self.remote}/requirements.txt "
+            f"&& echo {self.digest} > {INSTALLED_MARK}; fi"
+        )
+
+def download(dest: pathlib.Path):
+    args = [sys.executable, "-m", "pip", "download", "--quiet", "--only-binary=:all:",
+            "--python-version", PYTHON_VERSION, "--implementation", "cp", "--abi", ABI]
+    for p in PLATFORMS:
+        args += ["--platform", p]
+    subprocess.run(args + ["-d", str(dest), "-r", str(REQUIREMENTS), PIP], check=True)
+
+def digest_of(paths: list[pathlib.Path]) -> str:
+    h = hashlib.sha256()
+    for p in sorted(paths, key=lambda p: p.name):
+        h.update(p.name.encode() + b"\0")
+        h.update(p.read_bytes())
+    return h.hexdigest()[:16]
+
+def build() -> Wheelhouse:
+    # re-downloads only when node-requirements.txt or the target changed since the last build
+    target = f"{PIP} {PYTHON_VERSION} {' '.join(PLATFORMS)}".encode()
+    req_hash = hashlib.sha256(REQUIREMENTS.read_bytes() + target).hexdigest()[:16]
+    wheels_dir = CACHE / f"req-{req_hash}"
+    if not (wheels_dir / ".complete").exists():
+        print(f"Downloading pinned wheels into {wheels_dir} …")
+        wheels_dir.mkdir(parents=True, exist_ok=True)
+        download(wheels_dir)
+        (wheels_dir / "requirements.txt").write_bytes(REQUIREMENTS.read_bytes())
+        (wheels_dir / ".complete").touch()
+    files = sorted(p for p in wheels_dir.iterdir() if p.suffix == ".whl" or p.name == "requirements.txt")
+    digest = digest_of(files)
+    pip_wheel = next(p.name for p in files if p.name.startswith("pip-"))
+    tarball = CACHE / f"wheelhouse-{digest}.tar"
+    if not tarball.exists():
+        tmp = tarball.with_suffix(".tmp")
+        with tarfile.open(tmp, "w") as tar:
+            for p in files:
+                tar.add(p, arcname=p.name)
+        tmp.rename(tarball)
+    return Wheelhouse(digest, tarball, pip_wheel)
+
+if __name__ == "__main__":
+    wh = build()
+    print(f"{wh.tarball} ({wh.tarball.stat().st_size / 1e6:.1f} MB), hash {wh.digest}")
@@ -0,0 +1,194 @@
+# Tests for lb/lb.py that need no network: probes and shared-table rows are fed in directly.
+# Run from the repository root: python -m pytest tests (needs fastapi and httpx).
+import asyncio, os, pathlib, sys
+
+import httpx, pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parent.parent / "lb"))
+import cache  # noqa: E402
+import lb  # noqa: E402
+import strategies  # noqa: E402
+
+class Clock:
+    # time.perf_counter stand-in; only FakeClient moves it, so probe latencies are exact
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self) -> float:
+        return self.now
+
+class FakeClient:
+    # stands in for httpx.AsyncClient in LBState.probe_once: every probe answers 200, after
+    # the next latency from the list (in ms, cycled)
+    def __init__(self, clock: Clock, latencies_ms: list[float]):
+        self.clock, self.latencies, self.calls = clock, latencies_ms, 0
+
+    async def get(self, url, timeout=None):
+        self.clock.now += self.latencies[self.calls % len(self.latencies)] / 1000.0
+        self.calls += 1
+        return type("Resp", (), {"status_code": 200})()
+
+def probe(state: lb.LBState, tgt: lb.Target, client: FakeClient, times: int = 1):
+    for _ in range(times):
+        asyncio.run(state.probe_once(client, tgt))
+
+def is_slow(tgt: lb.Target) -> bool:
+    return lb.probe_delay(tgt) >= lb.PROBE_SLOW * (1.0 - lb.PROBE_JITTER)
+
+def test_steady_new_target_reaches_slow_probing(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(lb.time, "perf_counter", clock)
+    state = lb.LBState({"c": ["http://10.0.0.1:8000/c"]})
+    tgt = state.clusters["c"].targets[0]
+    client = FakeClient(clock, [20.0])
+    for n in range(1, 6):
+        probe(state, tgt, client)
+        assert tgt.dev_ms <= 0.5 * tgt.probe_ewma_ms, f"looks volatile after {n} probe(s)"
+    # five steady probes in a row: probed at the slow rate from now on
+    assert is_slow(tgt)
+
+def test_lan_jitter_is_not_volatile(monkeypatch):
+    # ~1 ms RTT with sub-millisecond jitter: the deviation is large relative to the EWMA,
+    # but below LB_PROBE_VOLATILE_MS
+    clock = Clock()
+    monkeypatch.setattr(lb.time, "perf_counter", clock)
+    state = lb.LBState({"c": ["http://10.0.0.1:8000/c"]})
+    tgt = state.clusters["c"].targets[0]
+    probe(state, tgt, FakeClient(clock, [0.3, 1.7]), times=6)
+    assert tgt.dev_ms > 0.5 * tgt.probe_ewma_ms
+    assert is_slow(tgt)
+
+def test_volatile_target_keeps_fast_probing(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(lb.time, "perf_counter", clock)
+    state = lb.LBState({"c": ["http://10.0.0.1:8000/c"]})
+    tgt = state.clusters["c"].targets[0]
+    probe(state, tgt, FakeClient(clock, [10.0, 90.0]), times=6)
+    assert lb.probe_delay(tgt) <= 2 * lb.PROBE_FAST * (1.0 + lb.PROBE_JITTER)
+
+def shared_row(tgt: lb.Target, healthy: bool, last_ok: float) -> tuple:
+    # one row as SharedTable.read returns it, in the order LBState.apply unpacks it
+    return (tgt.url, healthy, tgt.ewma_ms, tgt.last_ms, tgt.probe_ewma_ms, tgt.peak_ms, last_ok, 0)
+
+def test_non_leader_slow_starts_recovered_target():
+    state = lb.LBState({"c": ["http://10.0.0.1:8000/c"]})
+    tgt = state.clusters["c"].targets[0]
+    # first time healthy (never seen up before): full share straight away
+    state.apply({tgt.url: shared_row(tgt, True, 1000.0)})
+    assert not tgt.slow_start_at
+    # the leader saw it fail, then recover: this worker ramps it up as well
+    state.apply({tgt.url: shared_row(tgt, False, 1000.0)})
+    state.apply({tgt.url: shared_row(tgt, True, 1010.0)})
+    assert tgt.slow_start_at
+    assert lb.ramp(tgt) < 1.0
+
+@pytest.mark.parametrize("name", ["status", "metrics", "admin", "docs", "redoc", "openapi.json"])
+def test_reserved_cluster_names_are_rejected(name):
+    with pytest.raises(ValueError):
+        lb.parse_config({name: ["http://10.0.0.1:8000/x"]})
+
+def test_strategy_without_pick_fails_at_registration():
+    with pytest.raises(TypeError):
+        @strategies.register("no_pick")
+        class NoPick(strategies.Strategy):
+            pass
+    assert "no_pick" not in strategies.STRATEGIES
+
+class Body(httpx.AsyncByteStream):
+    async def __aiter__(self):
+        yield b"body"
+
+async def drop_before_body(spec: str) -> lb.Target:
+    # a streamed response whose client disconnects while the headers are being sent
+    tgt = lb.Target("http://10.0.0.1:8000/c", sem=asyncio.Semaphore(2))
+    await lb.acquire(tgt)
+    resp = lb.Relay(lb.Upstream(tgt, httpx.Response(200, stream=Body())))
+    scope = {"type": "http", "asgi": {"spec_version": spec}}
+
+    async def receive():
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if spec == "2.4":
+            raise OSError("client went away")
+        await asyncio.sleep(3600)   # 2.3: Starlette cancels this once it sees the disconnect
+    try:
+        await resp(scope, receive, send)
+    except Exception:
+        pass
+    return tgt
+
+@pytest.mark.parametrize("spec", ["2.3", "2.4"])
+def test_relay_releases_slots_when_client_drops_before_body(spec):
+    tgt = asyncio.run(drop_before_body(spec))
+    assert tgt.inflight == 0
+    assert tgt.sem is not None and tgt.sem._value == 2
+
+def test_every_metric_series_names_its_worker():
+    state = lb.LBState({"c": ["http://10.0.0.1:8000/c"]})
+    series = [line for line in state.render_metrics().splitlines() if not line.startswith("#")]
+    assert series
+    assert all(f'worker="{os.getpid()}"' in line for line in series)
+
+@pytest.mark.parametrize("headers, expected", [
+    ([(b"content-type", b"application/json")], True),
+    ([(b"cache-control", b"max-age=5")], True),
+    ([(b"set-cookie", b"session=abc")], False),
+    ([(b"cache-control", b"private, max-age=60")], False),
+    ([(b"cache-control", b"No-Cache")], False),
+    ([(b"cache-control", b"no-store")], False),
+])
+def test_cacheable(headers, expected):
+    assert cache.cacheable(200, headers) is expected
+
+def test_cookie_response_is_neither_cached_nor_shared():
+    calls = []
+
+    async def fetch():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return cache.Entry(200, [(b"set-cookie", f"session={len(calls)}".encode())], b"{}",
+                           cacheable=cache.cacheable(200, [(b"set-cookie", b"")]))
+
+    async def main():
+        c = cache.MicroCache(ttl_ms=60_000, max_size=10)
+        first, second = await asyncio.gather(c.get_or_fetch("k", fetch), c.get_or_fetch("k", fetch))
+        third = await c.get_or_fetch("k", fetch)
+        return first, second, third
+    first, second, third = asyncio.run(main())
+    assert len(calls) == 3
+    assert [how for _, how in (first, second, third)] == ["MISS", "MISS", "MISS"]
+    assert first[0].headers != second[0].headers
+
+def test_drained_target_is_reaped_without_the_config_watcher():
+    # LB_RELOAD_INTERVAL=0: nothing but the periodic upkeep runs between manual reloads
+    state = lb.LBState({"c": ["http://10.0.0.1:8000/c", "http://10.0.0.2:8000/c"]})
+    gone = state.clusters["c"].targets[1]
+    gone.inflight = 1
+    state.apply_config({"c": ["http://10.0.0.1:8000/c"]})
+    assert gone in state.clusters["c"].targets   # still draining its in-flight request
+    gone.inflight = 0
+    state.refresh()
+    assert [t.url for t in state.clusters["c"].targets] == ["http://10.0.0.1:8000/c"]
+    assert gone.url not in state.render_metrics()
+
+def test_retry_skips_a_hedge_target_that_refused(monkeypatch):
+    urls = [f"http://10.0.0.{i}:8000/c" for i in (1, 2, 3)]
+    state = lb.LBState({"c": urls})
+    g = state.clusters["c"]
+    for i, tgt in enumerate(g.targets):
+        tgt.healthy, tgt.ewma_ms = True, 1.0 + i
+    state.rebuild()
+    g.hedge_after_ms = 1.0
+    calls = []
+
+    async def send_to(g, tgt, query, headers):
+        calls.append(tgt.url)
+        if tgt.url == urls[2]:
+            return "upstream"
+        await asyncio.sleep(0.02 if tgt.url == urls[0] else 0)   # the hedge fails first
+        raise httpx.ConnectError("refused")
+    monkeypatch.setattr(lb, "state", state)
+    monkeypatch.setattr(lb, "send_to", send_to)
+    assert asyncio.run(lb.fetch_admitted("c", "", "")) == "upstream"
+    assert calls == urls   # first pick, its hedge, then the retry goes to the third target